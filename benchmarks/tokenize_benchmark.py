@@ -0,0 +1,61 @@
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spacy.lang.en.stop_words import STOP_WORDS
+
+from book import BookShelf
+from preprocess import Processor, RE_COMBINE_WHITESPACE
+
+
+def legacy_tokenize(paragraphs, stopwords):
+    # the simple tokenizer path of Processor before the stopword set / Counter rework
+    stopwords = list(stopwords)
+    corpus = []
+    for text in paragraphs:
+        tmp = text.translate({ord(c): " " for c in "!@#$%^&*()[]{};:,./<>?\\|`~-=_+1234567890"})
+        tmp = RE_COMBINE_WHITESPACE.sub(" ", tmp)
+        corpus.append(tmp)
+    tokens = [[word.strip() for word in document.lower().split() if
+               word.strip() not in stopwords and len(word.strip()) > 2]
+              for document in corpus]
+    wfrequencies = defaultdict(int)
+    for text in tokens:
+        for token in text:
+            if token.lower not in stopwords:
+                wfrequencies[token] += 1
+    return tokens, wfrequencies
+
+
+def current_tokenize(paragraphs, stopwords):
+    stopwords = frozenset(stopwords)
+    tokens = [Processor.simple_tokenize(Processor.normalize(text), stopwords) for text in paragraphs]
+    processor = Processor.__new__(Processor)
+    processor.stopwords = stopwords
+    processor.count_word_frequencies(refresh=True, tokens=tokens)
+    return tokens, processor.wfrequencies
+
+
+def benchmark(name, function, paragraphs, stopwords, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens, wfrequencies = function(paragraphs, stopwords)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    n_tokens = sum(len(text) for text in tokens)
+    print('{0:>8}: {1:>9} tokens in {2:.3f}s - {3:,.0f} tokens/sec'.format(name, n_tokens, best, n_tokens / best))
+    return tokens, wfrequencies
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    paragraphs = list(BookShelf.read_sample_books().create_corpus_df()['paragraph'])
+    print('{} paragraphs of the four sample books'.format(len(paragraphs)))
+    legacy = benchmark('before', legacy_tokenize, paragraphs, STOP_WORDS)
+    current = benchmark('after', current_tokenize, paragraphs, STOP_WORDS)
+    assert legacy[0] == current[0] and dict(legacy[1]) == dict(current[1]), 'tokenization results differ'
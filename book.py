@@ -1,126 +1,131 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import logging
 import requests
-import time
+
+from corpus import ColumnarCorpus
+from ingest import BookFetcher, HEADERS
 
 logging.basicConfig(level=logging.INFO)
 
+SAMPLE_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalogs', 'sample_books.json')
+CATALOG_REQUIRED_KEYS = ['book_name', 'text_address', 'start_phrase', 'end_phrase', 'parts_starter']
+CATALOG_OPTIONAL_KEYS = ['is_file', 'paragraph_pattern', 'length_thresholds']
+
+
+def _build_book(entry, whole_text=None):
+    b = Book(book_name=entry['book_name'], text_address=entry['text_address'])
+    if whole_text is None:
+        b.read(is_file=entry.get('is_file', False))
+    else:
+        b.whole_text = whole_text
+    b.trim(start_phrase=entry['start_phrase'], end_phrase=entry['end_phrase'])
+    b.find_parts(entry['parts_starter'])
+    b.find_paragraphs(paragraph_pattern=entry.get('paragraph_pattern', '\t'),
+                      length_thresholds=entry.get('length_thresholds', 150))
+    return b
+
 
 class BookShelf:
     @staticmethod
     def read_sample_books():
-        end_phrase = "*** END OF THE PROJECT GUTENBERG EBOOK"
         logging.info('{} - start checking the book files'.format('Bookshelf:'))
-        # create the first book object
-        b1 = Book(book_name='A Christmas Carol', text_address='https://www.gutenberg.org/cache/epub/46/pg46.txt')
-        # read and trim the text contents
-        b1.read_and_trim(start_phrase="STAVE I:  MARLEY'S GHOST", end_phrase=end_phrase)
-        b1_parts_starter = ["MARLEY was dead:",
-                            "WHEN Scrooge awoke, it was so dark",
-                            "AWAKING in the middle of a prodigiously tough snore",
-                            "THE Phantom slowly, gravely, silently, approached.",
-                            "YES! and the bedpost was his own",
-                            ]
-        b1.find_parts(b1_parts_starter)
-        b1.find_paragraphs()
-        logging.info("\t{} is preprocessed...".format(b1))
-        time.sleep(2)
-
-        # create the second book
-        b2 = Book(book_name="Crime and Punishment", text_address="https://www.gutenberg.org/files/2554/2554-0.txt")
-        # read and trim the text contents
-        b2.read_and_trim(start_phrase="PART I",
-                         end_phrase=end_phrase)
-        b2_parts_starter = ["On an exceptionally hot evening early in July ",
-                            "Raskolnikov was not used to crowds,",
-                            "He waked up late next day after a broken sleep.",
-                            "letter had been a torture to him, but as regards",
-                            "The question why he was now going to Razumihin agitated him",
-                            "Later on Raskolnikov happened to find out why the huckster",
-                            "The door was as before opened a tiny crack, and again",
-                            "So he lay a very long while.",
-                            "And what if there has been a search already?",
-                            "He was not completely unconscious",
-                            "Zossimov was a tall, fat man with a puffy",
-                            "This was a gentleman no longer young",
-                            "But as soon as she went out, he got up",
-                            "An elegant carriage stood in the middle of the road ",
-                            "Raskolnikov got up, and sat down on the sofa",
-                            "Razumihin waked up next morning at eight ",
-                            "He is well, quite well!",
-                            "At that moment the door was softly opened",
-                            "Raskolnikov was already entering the room.",
-                            "They were by now approaching Bakaleyev",
-                            "He looked carefully and suspiciously at the unexpected visitor.",
-                            "that landowner in whose house my sister was",
-                            "The fact was that up to the last moment he had never expected",
-                            "Raskolnikov went straight to the house on the canal",
-                            "When next morning at eleven o",
-                            "When he remembered the scene afterwards",
-                            "The morning that followed the fateful interview with Dounia",
-                            "It would be difficult to explain exactly what",
-                            "Katerina Ivanovna remained standing where she was",
-                            "Raskolnikov had been a vigorous and active champion",
-                            "Lebeziatnikov looked perturbed.",
-                            "A strange period began for Raskolnikov",
-                            "Porfiry Petrovitch ejaculated at last",
-                            "It means that I am not going to lose sight of you now.",
-                            "He spent that evening till ten o",
-                            "The same day, about seven o"
-                            ]
-        b2.find_parts(b2_parts_starter)
-        b2.find_paragraphs()
-        logging.info("\t{} is preprocessed...".format(b2))
-        time.sleep(2)
-
-        # create the third book
-        b3 = Book(book_name="Alice's Adventures in Wonderland",
-                  text_address="https://www.gutenberg.org/cache/epub/11/pg11.txt")
-        # read and trim the text contents
-        b3.read_and_trim(start_phrase="Alice was beginning to get very tired of sitting by her sister",
-                         end_phrase=end_phrase)
-        b3_parts_starter = ["Alice was beginning to get very tired of sitting by her sister",
-                            "CHAPTER II.",
-                            "CHAPTER III.",
-                            "CHAPTER IV.",
-                            "CHAPTER V.",
-                            "CHAPTER VI.",
-                            "CHAPTER VII.",
-                            "CHAPTER VIII.",
-                            "CHAPTER IX.",
-                            "CHAPTER X.",
-                            "CHAPTER XI.",
-                            "CHAPTER XII."
-                            ]
-        b3.find_parts(b3_parts_starter)
-        b3.find_paragraphs()
-        logging.info("\t{} is preprocessed...".format(b3))
-        time.sleep(2)
-
-        # create the fourth book
-        b4 = Book(book_name="Metamorphosis", text_address="https://www.gutenberg.org/files/5200/5200-0.txt")
-        # read and trim the text contents
-        b4.read_and_trim(start_phrase="Translated by David Wyllie",
-                         end_phrase=end_phrase)
-        b4_parts_starter = ["I",
-                            "II",
-                            "III"]
-        b4.find_parts(b4_parts_starter)
-        b4.find_paragraphs()
-        logging.info("\t{} is preprocessed...".format(b4))
+        return BookShelf.from_catalog(SAMPLE_CATALOG)
+
+    @staticmethod
+    def read_catalog(path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.json':
+            with open(path, 'r', encoding='utf-8') as fp:
+                catalog = json.load(fp)
+        elif extension in ['.yaml', '.yml']:
+            import yaml  # optional dependency, only needed for yaml catalogs
+            with open(path, 'r', encoding='utf-8') as fp:
+                catalog = yaml.safe_load(fp)
+        elif extension == '.csv':
+            catalog = []
+            for row in pd.read_csv(path, dtype=str, keep_default_na=False).to_dict('records'):
+                entry = {k: v for k, v in row.items() if v != ''}
+                # part starters are separated by '|' in a csv catalog
+                if 'parts_starter' in entry:
+                    entry['parts_starter'] = entry['parts_starter'].split('|')
+                if 'is_file' in entry:
+                    entry['is_file'] = entry['is_file'].lower() in ['1', 'true', 'yes']
+                if 'length_thresholds' in entry and entry['length_thresholds'].isdigit():
+                    entry['length_thresholds'] = int(entry['length_thresholds'])
+                catalog.append(entry)
+        else:
+            raise ValueError('unsupported catalog format: {}'.format(path))
+        if isinstance(catalog, dict) and 'books' in catalog:
+            catalog = catalog['books']
+        return catalog
+
+    @staticmethod
+    def validate_catalog(catalog):
+        if not isinstance(catalog, list):
+            raise ValueError('invalid book catalog:\n\texpected a list of books (or a mapping with a "books" list)')
+        errors = []
+        names = set()
+        for idx, entry in enumerate(catalog):
+            if not isinstance(entry, dict):
+                errors.append('book #{0}: expected a mapping of keys, got {1}'.format(idx + 1, type(entry).__name__))
+                continue
+            for key in CATALOG_REQUIRED_KEYS:
+                if entry.get(key) in [None, '']:
+                    errors.append('book #{0}: missing "{1}"'.format(idx + 1, key))
+            unknown = set(entry.keys()) - set(CATALOG_REQUIRED_KEYS) - set(CATALOG_OPTIONAL_KEYS)
+            if len(unknown) > 0:
+                errors.append('book #{0}: unknown keys {1}'.format(idx + 1, sorted(unknown)))
+            starters = entry.get('parts_starter')
+            if not isinstance(starters, list) or len(starters) == 0 or \
+                    not all(isinstance(starter, str) and starter != '' for starter in starters):
+                errors.append('book #{}: "parts_starter" must be a non-empty list of phrases'.format(idx + 1))
+            if 'is_file' in entry and not isinstance(entry['is_file'], bool):
+                errors.append('book #{}: "is_file" must be true or false'.format(idx + 1))
+            thresholds = entry.get('length_thresholds', 0)
+            if not isinstance(thresholds, int) or isinstance(thresholds, bool) or thresholds < 0:
+                errors.append('book #{}: "length_thresholds" must be a non-negative integer'.format(idx + 1))
+            pattern = entry.get('paragraph_pattern', '\t')
+            if not isinstance(pattern, str) or pattern == '':
+                errors.append('book #{}: "paragraph_pattern" must be a non-empty string'.format(idx + 1))
+            if entry.get('book_name') in names:
+                errors.append('book #{0}: duplicated book name "{1}"'.format(idx + 1, entry['book_name']))
+            names.add(entry.get('book_name'))
+        if len(errors) > 0:
+            raise ValueError('invalid book catalog:\n\t' + '\n\t'.join(errors))
 
+    @staticmethod
+    def from_catalog(path, fetcher=None, workers=None):
+        catalog = BookShelf.read_catalog(path)
+        BookShelf.validate_catalog(catalog)
+        logging.info('{0} books are listed in the catalog {1}'.format(len(catalog), path))
+        # download (or revalidate) all the remote texts concurrently, then segment the books in parallel
+        urls = [entry['text_address'] for entry in catalog if not entry.get('is_file', False)]
+        texts = {}
+        if len(urls) > 0:
+            if fetcher is None:
+                fetcher = BookFetcher()
+            texts = fetcher.fetch_many(urls)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            books = list(executor.map(_build_book, catalog,
+                                      [texts.get(entry['text_address']) for entry in catalog]))
+        for b in books:
+            logging.info("\t{} is preprocessed...".format(b))
 
         bookshelf = BookShelf()
-        bookshelf.add_book(b1)
-        bookshelf.add_book(b2)
-        bookshelf.add_book(b3)
-        bookshelf.add_book(b4)
+        bookshelf.add_books(books)
         logging.info('all books are added to the bookshelf object.\n')
         return bookshelf
 
     def __init__(self):
         self.books = []
         self.book_dict = {}
+        # memoized shelf dataframe and the row range of each (book, chapter) in it
+        self.corpus_df = None
+        self.corpus_index = None
 
     def generate_book_dict(self):
         self.book_dict = {book.book_name: book for book in self.books}
@@ -128,11 +133,18 @@ class BookShelf:
     def add_book(self, book):
         self.books.append(book)
         self.book_dict[book.book_name] = book
+        self.clear_cache()
 
     def add_books(self, books):
         self.books.extend(books)
         for book in books:
             self.book_dict[book.book_name] = book
+        self.clear_cache()
+
+    def clear_cache(self):
+        # needs to be called when a book of the shelf is segmented again
+        self.corpus_df = None
+        self.corpus_index = None
 
     def create_corpus(self, book='all'):
         if book == 'all':
@@ -149,25 +161,53 @@ class BookShelf:
                 corpus.extend(paragraphs)
         return corpus, corpus_info
 
-    def create_corpus_df(self):
-        df_dict_list = []
-        for b in self.books:
-            for part, paragraphs in b.paragraphs.items():
-                for idx, p in enumerate(paragraphs):
-                    df_dict_list.append({"book": b.book_name,
-                                         "chapter": part + 1,
-                                         "paragraph_number": idx + 1,
-                                         "paragraph": p})
+    def create_columnar_corpus(self, books=None):
+        if books is None:
+            books = self.books
+        return ColumnarCorpus.from_books(books)
 
-        return pd.DataFrame(df_dict_list)
+    def create_corpus_df(self, books=None):
+        if books is not None:
+            return self.create_columnar_corpus(books).to_df()
+        if self.corpus_df is None:
+            self.corpus_df = self.create_columnar_corpus().to_df()
+            self.corpus_index = {}
+            position = 0
+            for b in self.books:
+                for part, offsets in b.paragraph_offsets.items():
+                    self.corpus_index[(b.book_name, part + 1)] = (position, position + len(offsets))
+                    position += len(offsets)
+        # shallow copy, so that adding columns (e.g. sentiments) does not change the memoized dataframe
+        return self.corpus_df.copy(deep=False)
 
+    def split_corpus_df(self, store):
+        # stored artifacts of the unchanged books and the corpus of the new/changed books to process
+        stored_dfs = []
+        new_books = []
+        for b in self.books:
+            book_df = store.load(b)
+            if book_df is None:
+                new_books.append(b)
+            else:
+                stored_dfs.append(book_df)
+        logging.info('{0} books are loaded from the store, {1} books need processing'.format(
+            len(stored_dfs), len(new_books)))
+        stored_df = pd.concat(stored_dfs, ignore_index=True) if len(stored_dfs) > 0 else None
+        new_df = self.create_corpus_df(new_books) if len(new_books) > 0 else None
+        return stored_df, new_df
 
     def create_corpus_custom_df(self, book, chapters=[]):
-        all_df = self.create_corpus_df()
+        if self.corpus_df is None:
+            self.create_corpus_df()
         if len(chapters) == 0:
-            chapters = [i+1 for i in range(len(self.book_dict[book].parts))]
-        book_df = all_df[all_df['book'] == book]
-        chapters_df = book_df[book_df['chapter'].isin(chapters)]
+            chapters = [i+1 for i in range(len(self.book_dict[book].part_offsets))]
+        # slice the row ranges of the chapters instead of filtering the whole shelf
+        ranges = [self.corpus_index[(book, chapter)] for chapter in sorted(set(chapters))
+                  if (book, chapter) in self.corpus_index]
+        if len(ranges) > 0:
+            chapters_df = pd.concat([self.corpus_df.iloc[start:end] for start, end in ranges])
+        else:
+            chapters_df = self.corpus_df.iloc[0:0]
         chapters_df = chapters_df.reset_index()
         return chapters_df
 
@@ -178,49 +218,102 @@ class Book:
         self.book_name = book_name
         self.whole_text = ''
         self.trimmed_text = ''
-        self.parts = []
-        self.paragraphs = {}
+        # parts and paragraphs are kept as offsets into the trimmed text and materialized on demand
+        self.part_offsets = []
+        self.paragraph_offsets = {}
+
+    def read_and_trim(self, start_phrase, end_phrase, is_file=False, fetcher=None):
+        self.read(is_file, fetcher)
+        self.trim(start_phrase, end_phrase)
 
-    def read_and_trim(self, start_phrase, end_phrase, is_file=False):
+    def read(self, is_file=False, fetcher=None):
         if is_file:
             with open(self.text_address, 'r', encoding='latin-1') as fp:
                 self.whole_text = fp.read()
+        elif fetcher is not None:
+            self.whole_text = fetcher.fetch(self.text_address)
         else:
-            headers = {
-                'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/86.0.4240.75 Safari/537.36'}
-            req = requests.get(self.text_address, headers=headers)
+            req = requests.get(self.text_address, headers=HEADERS)
             self.whole_text = req.text
+
+    def trim(self, start_phrase, end_phrase):
         self.trimmed_text = self.whole_text[self.whole_text.index(start_phrase):self.whole_text.index(end_phrase)]
         logging.info('\t\ttext are trimmed - {}'.format(self.book_name))
 
+    @property
+    def parts(self):
+        return [self.trimmed_text[start:end] for start, end in self.part_offsets]
+
+    @property
+    def paragraphs(self):
+        return {idx: [self.paragraph_text(spans) for spans in offsets]
+                for idx, offsets in self.paragraph_offsets.items()}
+
+    def paragraph_text(self, spans):
+        # a paragraph may glue together several short (stripped) splits
+        if len(spans) == 1:
+            return self.trimmed_text[spans[0][0]:spans[0][1]]
+        return ''.join([self.trimmed_text[start:end] for start, end in spans])
+
     def find_parts(self, part_pattern_starter):
-        if self.parts is None or len(self.parts) > 0:
-            self.parts = []
-        for idx, starter in enumerate(part_pattern_starter):
-            start = self.trimmed_text.index(starter)
-            if idx < len(part_pattern_starter) - 1:
-                end = self.trimmed_text.index(part_pattern_starter[idx + 1])
+        # each starter is searched forward from the previous one, so the whole text is scanned only once
+        starts = []
+        position = 0
+        for starter in part_pattern_starter:
+            position = self.trimmed_text.find(starter, position)
+            if position < 0:
+                raise ValueError('part starter is not found after the previous part: {}'.format(starter))
+            starts.append(position)
+        self.part_offsets = []
+        for idx, start in enumerate(starts):
+            if idx < len(starts) - 1:
+                end = starts[idx + 1]
             else:
                 end = len(self.trimmed_text) - 1
-            part = self.trimmed_text[start:end]
-            self.parts.append(part)
-        logging.info('\t\t{} parts are identified'.format(len(self.parts)))
+            self.part_offsets.append((start, end))
+        logging.info('\t\t{} parts are identified'.format(len(self.part_offsets)))
 
     def find_paragraphs(self, paragraph_pattern='\t', length_thresholds=150):
+        if paragraph_pattern == '':
+            raise ValueError('empty paragraph pattern')
+        text = self.trimmed_text
         len_parags = 0
-        for idx, part in enumerate(self.parts):
-            if idx not in self.paragraphs.keys():
-                self.paragraphs[idx] = []
-            splitted = part.split(paragraph_pattern)
-            current = ''
-            for split in splitted:
-                current += split.strip()
-                if len(split.strip()) > length_thresholds:
-                    self.paragraphs[idx].append(current)
-                    current = ''
-            len_parags += len(self.paragraphs[idx])
+        self.paragraph_offsets = {}
+        for idx, (part_start, part_end) in enumerate(self.part_offsets):
+            self.paragraph_offsets[idx] = []
+            current = []
+            position = part_start
+            # walk over the splits of the part (same as part.split(paragraph_pattern)) without copying them
+            while position <= part_end:
+                split_end = text.find(paragraph_pattern, position, part_end)
+                if split_end < 0:
+                    split_end = part_end
+                start, end = Book.strip_span(text, position, split_end)
+                if end > start:
+                    current.append((start, end))
+                if end - start > length_thresholds:
+                    self.paragraph_offsets[idx].append(tuple(current))
+                    current = []
+                position = split_end + len(paragraph_pattern)
+            len_parags += len(self.paragraph_offsets[idx])
         logging.info('\t\tparagraphs are identified, total number of paragraphs in this book: {}\n'.format(len_parags))
 
+    @staticmethod
+    def strip_span(text, start, end):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return start, end
+
+    def fingerprint(self):
+        digest = hashlib.sha1(self.book_name.encode('utf-8'))
+        for part, paragraphs in sorted(self.paragraphs.items()):
+            digest.update('\x01{}'.format(part).encode('utf-8'))
+            for p in paragraphs:
+                digest.update('\x00{}'.format(p).encode('utf-8'))
+        return digest.hexdigest()
+
     def __str__(self):
         return self.book_name
 
@@ -0,0 +1,69 @@
+import hashlib
+import logging
+import sqlite3
+import time
+
+
+class SentimentCache:
+    def __init__(self, file_name='out/sentiment_cache.sqlite', max_entries=1000000):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # WAL mode and a generous timeout let several worker processes share the same cache file
+        self.connection = sqlite3.connect(file_name, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sentiments '
+                                '(key TEXT PRIMARY KEY, tag TEXT, score REAL, used REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS sentiments_used ON sentiments (used)')
+        self.connection.commit()
+
+    @staticmethod
+    def key(text, model_name):
+        return hashlib.sha1('{0}\n{1}'.format(model_name, text).encode('utf-8')).hexdigest()
+
+    def lookup(self, texts, model_name, chunk_size=500):
+        keys = {SentimentCache.key(text, model_name): text for text in texts}
+        found = {}
+        key_list = list(keys.keys())
+        for start in range(0, len(key_list), chunk_size):
+            chunk = key_list[start:start + chunk_size]
+            rows = self.connection.execute(
+                'SELECT key, tag, score FROM sentiments WHERE key IN ({})'.format(','.join('?' * len(chunk))),
+                chunk).fetchall()
+            for key, tag, score in rows:
+                found[keys[key]] = (tag, score)
+            # refresh the recency of the hits for the LRU eviction
+            self.connection.executemany('UPDATE sentiments SET used = ? WHERE key = ?',
+                                        [(time.time(), key) for key, _, _ in rows])
+        self.connection.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, predictions, model_name):
+        now = time.time()
+        self.connection.executemany('INSERT OR REPLACE INTO sentiments (key, tag, score, used) VALUES (?, ?, ?, ?)',
+                                    [(SentimentCache.key(text, model_name), tag, score, now)
+                                     for text, (tag, score) in predictions.items()])
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        size = self.size()
+        if size > self.max_entries:
+            self.connection.execute('DELETE FROM sentiments WHERE key IN '
+                                    '(SELECT key FROM sentiments ORDER BY used ASC LIMIT ?)',
+                                    (size - self.max_entries,))
+            self.connection.commit()
+            logging.info("\t{} least recently used sentences are evicted from the cache".format(
+                size - self.max_entries))
+
+    def size(self):
+        return self.connection.execute('SELECT COUNT(*) FROM sentiments').fetchone()[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': self.size()}
+
+    def close(self):
+        self.connection.close()
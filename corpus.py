@@ -0,0 +1,111 @@
+import json
+import logging
+import mmap
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa  # optional, the paragraph column is built on the corpus buffers without copying them
+except ImportError:
+    pa = None
+
+
+class ColumnarCorpus:
+    def __init__(self, book_names, buffers, book_id, chapter, paragraph_number, start, end):
+        # one contiguous utf-8 buffer per book, paragraphs are (start, end) byte offsets into it
+        self.book_names = book_names
+        self.buffers = buffers
+        self.book_id = book_id
+        self.chapter = chapter
+        self.paragraph_number = paragraph_number
+        self.start = start
+        self.end = end
+
+    @staticmethod
+    def from_books(books):
+        buffers = []
+        columns = {'book_id': [], 'chapter': [], 'paragraph_number': [], 'start': [], 'end': []}
+        for book_id, b in enumerate(books):
+            chunks = []
+            position = 0
+            for part, offsets in b.paragraph_offsets.items():
+                for idx, spans in enumerate(offsets):
+                    data = b.paragraph_text(spans).encode('utf-8')
+                    chunks.append(data)
+                    columns['book_id'].append(book_id)
+                    columns['chapter'].append(part + 1)
+                    columns['paragraph_number'].append(idx + 1)
+                    columns['start'].append(position)
+                    position += len(data)
+                    columns['end'].append(position)
+            buffers.append(b''.join(chunks))
+        return ColumnarCorpus([b.book_name for b in books], buffers,
+                              np.array(columns['book_id'], dtype=np.int32),
+                              np.array(columns['chapter'], dtype=np.int32),
+                              np.array(columns['paragraph_number'], dtype=np.int32),
+                              np.array(columns['start'], dtype=np.int64),
+                              np.array(columns['end'], dtype=np.int64))
+
+    def __len__(self):
+        return len(self.book_id)
+
+    def paragraph(self, idx):
+        return self.buffers[self.book_id[idx]][self.start[idx]:self.end[idx]].decode('utf-8')
+
+    def paragraphs(self):
+        for book_id, start, end in zip(self.book_id, self.start, self.end):
+            yield self.buffers[book_id][start:end].decode('utf-8')
+
+    def paragraph_array(self):
+        if pa is None:
+            return np.array(list(self.paragraphs()), dtype=object)
+        # one arrow chunk per run of rows of the same book, its offsets point into the book buffer
+        chunks = []
+        runs = np.flatnonzero(np.diff(self.book_id)) + 1
+        for rows in np.split(np.arange(len(self)), runs) if len(self) > 0 else []:
+            start, end = self.start[rows], self.end[rows]
+            buffer = self.buffers[self.book_id[rows[0]]]
+            if np.array_equal(start[1:], end[:-1]):
+                # contiguous paragraphs (as written by from_books): zero copy
+                data = pa.py_buffer(buffer)
+                offsets = np.append(start, end[-1]).astype(np.int64)
+            else:
+                data = pa.py_buffer(b''.join(buffer[s:e] for s, e in zip(start, end)))
+                offsets = np.append(0, np.cumsum(end - start)).astype(np.int64)
+            chunks.append(pa.LargeStringArray.from_buffers(len(rows), pa.py_buffer(offsets), data))
+        return pd.arrays.ArrowExtensionArray(pa.chunked_array(chunks, type=pa.large_string()))
+
+    def to_df(self):
+        df = pd.DataFrame({'book': np.array(self.book_names, dtype=object)[self.book_id],
+                           'chapter': self.chapter.astype(np.int64),
+                           'paragraph_number': self.paragraph_number.astype(np.int64),
+                           'paragraph': self.paragraph_array()})
+        return df
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for book_id, buffer in enumerate(self.buffers):
+            with open(os.path.join(directory, 'book_{}.txt'.format(book_id)), 'wb') as fp:
+                fp.write(buffer)
+        with open(os.path.join(directory, 'books.json'), 'w', encoding='utf-8') as fp:
+            json.dump(self.book_names, fp)
+        np.savez(os.path.join(directory, 'corpus.npz'), book_id=self.book_id, chapter=self.chapter,
+                 paragraph_number=self.paragraph_number, start=self.start, end=self.end)
+        logging.info('columnar corpus is saved in {}'.format(directory))
+
+    @staticmethod
+    def load(directory, use_mmap=True):
+        with open(os.path.join(directory, 'books.json'), 'r', encoding='utf-8') as fp:
+            book_names = json.load(fp)
+        buffers = []
+        for book_id in range(len(book_names)):
+            with open(os.path.join(directory, 'book_{}.txt'.format(book_id)), 'rb') as fp:
+                if use_mmap and os.fstat(fp.fileno()).st_size > 0:
+                    buffers.append(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+                else:
+                    buffers.append(fp.read())
+        arrays = np.load(os.path.join(directory, 'corpus.npz'))
+        return ColumnarCorpus(book_names, buffers, arrays['book_id'], arrays['chapter'],
+                              arrays['paragraph_number'], arrays['start'], arrays['end'])
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+# additive statistics of every cell, they are merged without going back to the rows
+CELL_AGGREGATIONS = {'rows': 'sum', 'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+
+
+class RollupCube:
+    def __init__(self, keys, measure, bins=1000, value_range=(0.0, 1.0)):
+        # cells at the finest grain (keys) with the statistics of the measure column, coarser views are rolled up
+        self.keys = list(keys)
+        self.measure = measure
+        self.bins = bins
+        self.value_range = value_range
+        self.cells = None
+        # quantile sketch: sparse fixed-width histograms of the measure, the (cell position, bin) pairs with the
+        # count, the sum, the smallest and the largest of their values, i.e. the exact values of bins of up to 3 rows
+        self.sketch = None
+        # rolled up views, dropped whenever the cube is updated
+        self.views = {}
+
+    @classmethod
+    def from_frame(cls, df, keys, measure, bins=1000, value_range=(0.0, 1.0)):
+        cube = cls(keys, measure, bins, value_range)
+        cube.update(df)
+        return cube
+
+    def aggregate(self, df):
+        values = df[self.measure].astype(float)
+        # missing keys are kept as cells of their own, they are only dropped when a view groups by them
+        grouped = values.groupby([df[key] for key in self.keys], dropna=False)
+        cells = grouped.agg(['size', 'count', 'sum', 'min', 'max']).rename(columns={'size': 'rows'})
+        valid = values.notna().to_numpy()
+        low, high = self.value_range
+        bins = np.clip(np.floor((values.to_numpy()[valid] - low) / (high - low) * self.bins), 0, self.bins - 1)
+        measured = values.to_numpy()[valid]
+        sketch = self.combine(grouped.ngroup().to_numpy()[valid], bins.astype(np.int64),
+                              np.ones(valid.sum(), dtype=np.int64), measured, measured, measured)
+        return cells, sketch
+
+    def combine(self, cell, bins, count, total, smallest, largest):
+        # merges the statistics of the duplicated (cell, bin) pairs, sorted by cell and bin
+        pairs, inverse = np.unique(cell * self.bins + bins, return_inverse=True)
+        if len(pairs) == 0:
+            return pairs, pairs, count[:0], total[:0], smallest[:0], largest[:0]
+        order = np.argsort(inverse, kind='stable')
+        starts = np.searchsorted(inverse[order], np.arange(len(pairs)))
+        return (pairs // self.bins, pairs % self.bins,
+                np.bincount(inverse, weights=count).astype(np.int64),
+                np.bincount(inverse, weights=total),
+                np.minimum.reduceat(smallest[order], starts),
+                np.maximum.reduceat(largest[order], starts))
+
+    def update(self, df):
+        # incremental: only the new rows are aggregated, then merged into the existing cells
+        cells, sketch = self.aggregate(df)
+        if self.cells is not None:
+            merged = pd.concat([self.cells, cells]).groupby(level=self.keys, dropna=False).agg(CELL_AGGREGATIONS)
+            # cell positions of both sketches are moved to the positions of the merged cells
+            old_cell = merged.index.get_indexer(self.cells.index)[self.sketch[0]]
+            new_cell = merged.index.get_indexer(cells.index)[sketch[0]]
+            sketch = self.combine(np.concatenate([old_cell, new_cell]),
+                                  *[np.concatenate([old, new]) for old, new in zip(self.sketch[1:], sketch[1:])])
+            cells = merged
+        self.cells = cells
+        self.sketch = sketch
+        self.views = {}
+        return self
+
+    def quantile(self, q, by):
+        # quantile of every group of the view, in the order of self.cells.groupby(level=by), linearly interpolated
+        # between the two closest ranks like pandas; the value of a rank is exact when its bin holds up to 3 values
+        # of the group (so always for groups of up to 3 rows), otherwise it is interpolated between the smallest
+        # and the largest value of the bin, an error below the bin width (1 / bins of the value range)
+        grouped = self.cells.groupby(level=by)
+        n_groups = grouped.ngroups
+        # cells with a missing key in by belong to no group (NaN)
+        groups = grouped.ngroup().fillna(-1).to_numpy().astype(np.int64)
+        group = groups[self.sketch[0]]
+        kept = group >= 0
+        group, bins, count, total, smallest, largest = self.combine(group[kept],
+                                                                    *[array[kept] for array in self.sketch[1:]])
+        cumulative = np.cumsum(count)
+        totals = np.bincount(group, weights=count, minlength=n_groups)
+        measured = totals > 0
+        start = (np.cumsum(totals) - totals)[measured]
+        rank = (totals[measured] - 1) * q
+        lower = np.floor(rank)
+
+        def value_at(rank):
+            # the sketch entry of a rank is the first one whose cumulative count is above it
+            entry = np.searchsorted(cumulative, rank, side='right')
+            n, offset = count[entry], rank - (cumulative[entry] - count[entry])
+            middle = total[entry] - smallest[entry] - largest[entry]
+            spread = smallest[entry] + (largest[entry] - smallest[entry]) * offset / np.maximum(n - 1, 1)
+            return np.where((n == 3) & (offset == 1), middle, spread)
+
+        lower_value = value_at(start + lower)
+        upper_value = value_at(start + np.ceil(rank))
+        values = np.full(n_groups, np.nan)
+        values[measured] = lower_value + (rank - lower) * (upper_value - lower_value)
+        return values
+
+    def rollup(self, by):
+        if tuple(by) not in self.views:
+            view = self.cells.groupby(level=by).agg(CELL_AGGREGATIONS)
+            view['mean'] = view['sum'] / view['count']
+            # the sketch can not be more precise than the observed extremes
+            view['median'] = pd.Series(self.quantile(0.5, by), index=view.index).clip(view['min'], view['max'])
+            self.views[tuple(by)] = view
+        return self.views[tuple(by)].copy()
+
+    def report(self, by, column, stats, names=None):
+        # same layout as df.groupby(by, as_index=False).agg({column: names or stats})
+        view = self.rollup(by)[stats]
+        view.columns = pd.MultiIndex.from_product([[column], names or stats])
+        return view.reset_index()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HEADERS = {
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/86.0.4240.75 Safari/537.36'}
+
+
+class RateLimiter:
+    def __init__(self, min_interval=2.0):
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, host):
+        # reserve the next free slot of the host, then sleep outside the lock until it comes
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class BookFetcher:
+    def __init__(self, cache_dir='out/texts', max_workers=8, min_interval=2.0, max_age=24 * 3600, timeout=60):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(min_interval)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(HEADERS)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + '.txt'), os.path.join(self.cache_dir, key + '.json')
+
+    def fetch(self, url):
+        text_path, meta_path = self.cache_paths(url)
+        meta = None
+        if os.path.exists(text_path) and os.path.exists(meta_path):
+            with open(meta_path, 'r') as fp:
+                meta = json.load(fp)
+            if time.time() - meta['checked'] < self.max_age:
+                return BookFetcher.read_text(text_path)
+
+        headers = {}
+        if meta is not None:
+            # revalidate the cached copy instead of downloading it again
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        self.rate_limiter.wait(urlparse(url).netloc)
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and meta is not None:
+            logging.info('\t\tcached text is still valid - {}'.format(url))
+            meta['checked'] = time.time()
+            text = BookFetcher.read_text(text_path)
+        else:
+            response.raise_for_status()
+            logging.info('\t\ttext is downloaded - {}'.format(url))
+            meta = {'url': url,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'checked': time.time()}
+            text = response.text
+            with open(text_path, 'w', encoding='utf-8', newline='') as fp:
+                fp.write(text)
+        with open(meta_path, 'w') as fp:
+            json.dump(meta, fp)
+        return text
+
+    def fetch_many(self, urls):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            texts = list(executor.map(self.fetch, urls))
+        return dict(zip(urls, texts))
+
+    @staticmethod
+    def read_text(path):
+        with open(path, 'r', encoding='utf-8', newline='') as fp:
+            return fp.read()
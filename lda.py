@@ -1,16 +1,122 @@
-from gensim.corpora.dictionary import Dictionary
-from gensim.models import LdaMulticore, HdpModel
-from gensim.models import CoherenceModel
-from preprocess import Processor
-import matplotlib.pyplot as plt
+from preprocess import Processor, StreamingProcessor, TokenSpill
+from store import ArtifactStore
 import pandas as pd
 
 
+import copy
 import logging
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+import numpy as np
+
+# gensim and matplotlib are imported lazily (inside the methods) to keep 'import lda' fast
+
+TOPIC_COLUMNS = ['dominant_topic', 'perc_contribution', 'topic_keywords']
+
+# read-only inputs of the coherence sweep, loaded once per worker process
+_sweep_data = {}
+
+
+def _dump_coherence_index(accumulator, file_name):
+    # the (co-)occurrence counts of the sliding window measures are stored as .npy files next to the pickle,
+    # so that every sweep worker memory-maps the same read-only copy instead of unpickling its own
+    from gensim.topic_coherence.text_analysis import WordOccurrenceAccumulator
+    shape = None
+    if isinstance(accumulator, WordOccurrenceAccumulator):
+        co_occurrences = accumulator._co_occurrences.tocsr()
+        shape = co_occurrences.shape
+        arrays = {'occurrences': accumulator._occurrences, 'data': co_occurrences.data,
+                  'indices': co_occurrences.indices, 'indptr': co_occurrences.indptr}
+        for name, array in arrays.items():
+            np.save('{0}.{1}.npy'.format(file_name, name), array)
+        accumulator = copy.copy(accumulator)
+        accumulator._occurrences = None
+        accumulator._co_occurrences = None
+        # the workers load the dictionary anyway
+        accumulator.dictionary = None
+        accumulator.token2id = None
+    with open(file_name, 'wb') as fp:
+        pickle.dump({'accumulator': accumulator, 'shape': shape}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_coherence_index(file_name, dictionary):
+    from scipy.sparse import csr_matrix
+    with open(file_name, 'rb') as fp:
+        index = pickle.load(fp)
+    accumulator = index['accumulator']
+    if index['shape'] is not None:
+        arrays = {name: np.load('{0}.{1}.npy'.format(file_name, name), mmap_mode='r')
+                  for name in ['occurrences', 'data', 'indices', 'indptr']}
+        accumulator._occurrences = arrays['occurrences']
+        accumulator._co_occurrences = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                                 shape=index['shape'], copy=False)
+        accumulator.dictionary = dictionary
+        accumulator.token2id = dictionary.token2id
+    return accumulator
+
+
+def _init_sweep_worker(bow_file, dictionary_file, texts_file, index_files):
+    from gensim.corpora import MmCorpus, Dictionary
+    _sweep_data['bow_corpus'] = MmCorpus(bow_file)
+    _sweep_data['dictionary'] = Dictionary.load(dictionary_file)
+    _sweep_data['texts'] = TokenSpill(texts_file) if texts_file is not None else None
+    _sweep_data['coherence_index'] = {}
+    for scoring_method, index_file in index_files.items():
+        _sweep_data['coherence_index'][scoring_method] = _load_coherence_index(index_file, _sweep_data['dictionary'])
+
+
+def _evaluate_topics(num_topics, seed, scoring_methods, passes, iterations):
+    # single core models, the parallelism is across the grid of the sweep
+    from gensim.models import LdaModel, CoherenceModel
+    start = time.perf_counter()
+    lda_model = LdaModel(corpus=_sweep_data['bow_corpus'],
+                         id2word=_sweep_data['dictionary'],
+                         iterations=iterations,
+                         num_topics=num_topics,
+                         passes=passes,
+                         eval_every=None,  # the perplexity log is not needed for the sweep
+                         random_state=seed)
+    train_time = time.perf_counter() - start
+    results = []
+    for scoring_method in scoring_methods:
+        start = time.perf_counter()
+        if scoring_method == "u_mass":
+            cm = CoherenceModel(model=lda_model,
+                                corpus=_sweep_data['bow_corpus'],
+                                dictionary=_sweep_data['dictionary'],
+                                coherence=scoring_method,
+                                processes=1)
+        else:
+            cm = CoherenceModel(model=lda_model, texts=_sweep_data['texts'],
+                                corpus=_sweep_data['bow_corpus'],
+                                dictionary=_sweep_data['dictionary'],
+                                coherence=scoring_method,
+                                processes=1)
+        # reuse the precomputed (co-)occurrence statistics instead of accumulating them again for this model
+        cm._accumulator = _sweep_data['coherence_index'][scoring_method]
+        coherence = cm.get_coherence()
+        results.append({'num_topics': num_topics,
+                        'seed': seed,
+                        'scoring_method': scoring_method,
+                        'coherence': coherence,
+                        'train_time': train_time,
+                        'coherence_time': time.perf_counter() - start})
+    return results
 
 class LDAModel:
-    def __init__(self, df):
+    def __init__(self, df, artifact_dir=None):
         self.df = df
+        # preprocessing and bag of words artifacts are reused when the corpus and the parameters are unchanged
+        self.store = ArtifactStore(artifact_dir) if artifact_dir is not None else None
+        self.fingerprint = None
+        self.bow_fingerprint = None
+        # (co-)occurrence statistics over the whole vocabulary per coherence measure, shared by all the models
+        self.coherence_index = {}
         self.corpus = df['paragraph']
         self.processor = None  # lazy loading
         self.dictionary = None
@@ -19,69 +125,316 @@ class LDAModel:
         self.lda_model = None
         self.hdp_model = None
         self.corpus_topics = []
+        # normalized topic distribution of every paragraph, rows are aligned with self.df
+        self.doc_topic_matrix = None
+        # set by load: the directory of the saved model and whether its arrays are memory-mapped read-only
+        self.saved_directory = None
+        self.read_only = False
 
-    def preprocess(self, simple_tokenizer=True, custom_stopwords=[]):
+    def preprocess(self, simple_tokenizer=True, custom_stopwords=[], n_process=1, batch_size=1000,
+                   split_sentences=False, streaming=False, spill_file='out/tokens.txt', min_freq=5, max_freq=200,
+                   reuse_tokens=False):
+        # reuse_tokens: the tokens column of the dataframe (e.g. the stored_df of BookShelf.split_corpus_df) was
+        # produced with the same tokenizer settings and is not tokenized again
         logging.info("Calling preprocessing in LDA model:\n")
-        self.processor = Processor(self.df, simple_tokenizer, custom_stopwords)
-        # here, I can run any fancy preprocessing workflow that I need :)
-        self.processor.preprocess()
+        self.fingerprint = None
+        if streaming and split_sentences:
+            raise ValueError('sentences can not be split in streaming mode, the paragraphs are not kept')
+        if streaming:
+            # tokens are spilled to the disk and the processed documents are a restartable stream
+            self.processor = StreamingProcessor(self.corpus, simple_tokenizer, custom_stopwords, spill_file,
+                                                n_process, batch_size)
+            self.processed = self.processor.preprocess(min_freq=min_freq, max_freq=max_freq)
+            logging.info("Streaming preprocessing is done - from LDA model:\n")
+            return
+        if self.store is not None:
+            self.fingerprint = ArtifactStore.fingerprint(self.corpus, {'simple_tokenizer': simple_tokenizer,
+                                                                       'custom_stopwords': sorted(custom_stopwords),
+                                                                       'split_sentences': split_sentences,
+                                                                       'min_freq': min_freq,
+                                                                       'max_freq': max_freq,
+                                                                       'reuse_tokens': reuse_tokens})
+        if self.store is not None and self.store.has(self.fingerprint, 'preprocess'):
+            logging.info("\tpreprocessing artifacts are reloaded: {}".format(self.fingerprint))
+            artifacts = self.store.load(self.fingerprint, 'preprocess')
+            df = self.df.copy()
+            df['tokens'] = artifacts['tokens']
+            self.processor = Processor(df, simple_tokenizer, custom_stopwords, n_process, batch_size,
+                                       reuse_tokens=True)
+            self.processor.restore(artifacts)
+        else:
+            self.processor = Processor(self.df, simple_tokenizer, custom_stopwords, n_process, batch_size,
+                                       reuse_tokens)
+            # here, I can run any fancy preprocessing workflow that I need :)
+            self.processor.preprocess(min_freq=min_freq, max_freq=max_freq)
+            if split_sentences:
+                # the sentences are kept in the dataframe and reused by Sentiment
+                self.processor.split_sentences()
+            if self.store is not None:
+                self.store.save(self.fingerprint, 'preprocess', self.processor.artifacts())
         self.processed = self.processor.processed
         self.processor.map_to_df()
         self.df = self.processor.df
         logging.info("Preprocessing is done - from LDA model:\n")
 
-    def create_bow_model(self, filter_below=5, filter_above=200, keep_n=4000):
+    def update(self, df, chunksize=2000):
+        # incremental mode: only the new documents are preprocessed and fed to the online LDA update
+        logging.info("Updating the LDA model with {} new documents:\n".format(len(df)))
+        if self.read_only:
+            raise ValueError('the model arrays are memory-mapped read-only, load it with warm_start=True to update it')
+        new_processed = self.processor.extend(df)
+        # the new rows are appended to the model's own dataframe, so the columns added since the preprocessing
+        # (topics, sentiments...) are kept for the existing rows
+        new_rows = df
+        if self.processor.df is not None:
+            # with the tokens and processed documents of the new rows (the streaming preprocessor keeps none)
+            new_rows = self.processor.df.iloc[len(self.processor.df) - len(df):]
+        self.df = pd.concat([self.df, new_rows], ignore_index=True)
+        self.corpus = self.df['paragraph']
+        self.processed = self.processor.processed
+        # the vocabulary of the trained models is fixed: the dictionary is not extended and doc2bow drops the
+        # unknown words, new words are only used after a full retrain (create_bow_model)
+        new_bow_corpus = [self.dictionary.doc2bow(doc) for doc in new_processed]
+        if isinstance(self.bow_corpus, list):
+            self.bow_corpus.extend(new_bow_corpus)
+        else:
+            self.bow_corpus = self.append_bow(new_bow_corpus)
+        # the stored artifacts belong to the corpus before the update, they must not be reloaded for this one
+        self.fingerprint = None
+        self.bow_fingerprint = None
+        self.coherence_index = {}
+        self.doc_topic_matrix = None
+        if self.lda_model is not None:
+            from gensim.models import LdaMulticore
+            if isinstance(self.lda_model, LdaMulticore):
+                # LdaMulticore.update has no chunksize argument, it uses the one of the model
+                self.lda_model.chunksize = chunksize
+                self.lda_model.update(new_bow_corpus)
+            else:
+                self.lda_model.update(new_bow_corpus, chunksize=chunksize)
+        logging.info("LDA model is updated...")
+
+    def append_bow(self, new_bow_corpus):
+        # a streamed bag of words is serialized again with the new documents at the end, in a single pass
+        from gensim.corpora import MmCorpus
+        bow_file = self.bow_corpus.input
+        saved = self.saved_directory is not None and \
+            os.path.abspath(bow_file) == os.path.abspath(os.path.join(self.saved_directory, 'bow.mm'))
+        if self.bow_fingerprint is not None or saved:
+            # the file is a stored artifact (or part of a saved model) of the corpus before the update, it is kept
+            bow_file = os.path.splitext(bow_file)[0] + '_updated.mm'
+        tmp_file = bow_file + '.tmp'
+        MmCorpus.serialize(tmp_file, chain(self.bow_corpus, new_bow_corpus), id2word=self.dictionary)
+        os.replace(tmp_file, bow_file)
+        os.replace(tmp_file + '.index', bow_file + '.index')
+        return MmCorpus(bow_file)
+
+    def create_bow_model(self, filter_below=5, filter_above=200, keep_n=4000, serialize_to=None):
+        # with serialize_to, the bag of words is streamed to a Matrix Market file and read back from the disk
+        from gensim.corpora.dictionary import Dictionary
+        from gensim.corpora import MmCorpus
+        self.coherence_index = {}
+        bow_fingerprint = None
+        bow_file = serialize_to
+        if self.store is not None and self.fingerprint is not None:
+            bow_fingerprint = ArtifactStore.fingerprint([self.fingerprint], {'filter_below': filter_below,
+                                                                             'filter_above': filter_above,
+                                                                             'keep_n': keep_n})
+            bow_file = self.store.path(bow_fingerprint, 'bow.mm')
+            if self.store.has(bow_fingerprint, 'dictionary'):
+                self.dictionary = self.store.load(bow_fingerprint, 'dictionary')
+                if serialize_to is not None:
+                    self.bow_corpus = MmCorpus(bow_file)
+                else:
+                    self.bow_corpus = [[(word_id, int(count)) for word_id, count in bow]
+                                       for bow in MmCorpus(bow_file)]
+                logging.info("Bag of word representations are reloaded: {}".format(bow_fingerprint))
+                self.bow_fingerprint = bow_fingerprint
+                return
         self.dictionary = Dictionary(self.processed)
         self.dictionary.filter_extremes(no_below=filter_below, no_above=filter_above, keep_n=keep_n)
-        self.bow_corpus = [self.dictionary.doc2bow(doc) for doc in self.processed]
+        if serialize_to is not None:
+            # a single pass over the documents, none of the bag of words is kept in memory
+            MmCorpus.serialize(bow_file, (self.dictionary.doc2bow(doc) for doc in self.processed),
+                               id2word=self.dictionary)
+            self.bow_corpus = MmCorpus(bow_file)
+        else:
+            self.bow_corpus = [self.dictionary.doc2bow(doc) for doc in self.processed]
+            if bow_fingerprint is not None:
+                MmCorpus.serialize(bow_file, self.bow_corpus, id2word=self.dictionary)
+        if bow_fingerprint is not None:
+            # the dictionary is saved last, its presence marks a complete set of bag of words artifacts
+            self.store.save(bow_fingerprint, 'dictionary', self.dictionary)
+        self.bow_fingerprint = bow_fingerprint
         logging.info("Bag of word representations are constructed...")
 
-    def plot_optimal_coherent_scores(self, scoring_method="c_v", start_range=1, end_range=15):
-        topics = []
-        score = []
-        for i in range(start_range, end_range):
-            lda_model = LdaMulticore(corpus=self.bow_corpus,
-                                     id2word=self.dictionary,
-                                     iterations=10,
-                                     num_topics=i,
-                                     workers=8,
-                                     passes=10,
-                                     random_state=100)
-            if scoring_method == "u_mass":
-                cm = CoherenceModel(model=lda_model,
-                                    corpus=self.bow_corpus,
-                                    dictionary=self.dictionary,
-                                    coherence=scoring_method)
-            elif scoring_method == "c_v":
-                cm = CoherenceModel(model=lda_model, texts=self.processed,
-                                    corpus=self.bow_corpus,
-                                    dictionary=self.dictionary,
-                                    coherence=scoring_method)
-            topics.append(i)
-            score.append(cm.get_coherence())
-        plt.plot(topics, score)
+    def build_coherence_index(self, scoring_method="c_v", file_name=None):
+        # occurrences and co-occurrences of the whole dictionary vocabulary, a superset of any model's top words
+        from gensim.models.coherencemodel import BOOLEAN_DOCUMENT_BASED, SLIDING_WINDOW_SIZES
+        from gensim.topic_coherence.text_analysis import CorpusAccumulator, WordOccurrenceAccumulator
+        if scoring_method in self.coherence_index:
+            return self.coherence_index[scoring_method]
+        if file_name is None and self.store is not None and self.bow_fingerprint is not None:
+            file_name = self.store.path(self.bow_fingerprint, 'coherence_{}.pkl'.format(scoring_method))
+        if file_name is not None and os.path.exists(file_name):
+            with open(file_name, 'rb') as fp:
+                accumulator = pickle.load(fp)
+            logging.info("coherence index ({0}) is loaded from {1}".format(scoring_method, file_name))
+        else:
+            relevant_ids = set(self.dictionary.keys())
+            if scoring_method in BOOLEAN_DOCUMENT_BASED:
+                accumulator = CorpusAccumulator(relevant_ids).accumulate(self.bow_corpus)
+            else:
+                accumulator = WordOccurrenceAccumulator(relevant_ids, self.dictionary).accumulate(
+                    self.processed, SLIDING_WINDOW_SIZES[scoring_method])
+            logging.info("coherence index ({}) is built".format(scoring_method))
+            if file_name is not None:
+                with open(file_name, 'wb') as fp:
+                    pickle.dump(accumulator, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        self.coherence_index[scoring_method] = accumulator
+        return accumulator
+
+    def coherence(self, model, scoring_method="c_v"):
+        from gensim.models import CoherenceModel
+        if scoring_method == "u_mass":
+            cm = CoherenceModel(model=model,
+                                corpus=self.bow_corpus,
+                                dictionary=self.dictionary,
+                                coherence=scoring_method)
+        else:
+            cm = CoherenceModel(model=model, texts=self.processed,
+                                corpus=self.bow_corpus,
+                                dictionary=self.dictionary,
+                                coherence=scoring_method)
+        cm._accumulator = self.build_coherence_index(scoring_method)
+        return cm.get_coherence()
+
+    def coherence_sweep(self, start_range=1, end_range=15, scoring_methods=('c_v',), seeds=(100,), workers=None,
+                        passes=10, iterations=10, patience=None, min_delta=1e-3, sweep_dir='out/sweep'):
+        # the corpus, dictionary and texts are shared with the workers through files instead of pickling per task
+        from gensim.corpora import MmCorpus
+        os.makedirs(sweep_dir, exist_ok=True)
+        bow_file = os.path.join(sweep_dir, 'bow.mm')
+        dictionary_file = os.path.join(sweep_dir, 'dictionary')
+        texts_file = None
+        if isinstance(self.bow_corpus, MmCorpus):
+            # already on the disk (streaming mode), the workers read the same file
+            bow_file = self.bow_corpus.input
+        else:
+            MmCorpus.serialize(bow_file, self.bow_corpus, id2word=self.dictionary)
+        self.dictionary.save(dictionary_file)
+        if any(method != 'u_mass' for method in scoring_methods):
+            texts_file = os.path.join(sweep_dir, 'texts.txt')
+            TokenSpill(texts_file).write(self.processed)
+        # the coherence statistics are accumulated once, not once per candidate model
+        index_files = {}
+        for scoring_method in scoring_methods:
+            index_files[scoring_method] = os.path.join(sweep_dir, 'coherence_{}.pkl'.format(scoring_method))
+            _dump_coherence_index(self.build_coherence_index(scoring_method), index_files[scoring_method])
+        if workers is None:
+            workers = os.cpu_count()
+
+        grid = list(range(start_range, end_range))
+        results = []
+        best, best_at = None, None
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_sweep_worker,
+                                 initargs=(bow_file, dictionary_file, texts_file, index_files)) as executor:
+            # topic counts are evaluated in waves, so that the sweep can stop early once the coherence plateaus
+            wave_size = max(1, workers // len(seeds))
+            for wave_start in range(0, len(grid), wave_size):
+                wave = grid[wave_start:wave_start + wave_size]
+                futures = [executor.submit(_evaluate_topics, num_topics, seed, scoring_methods, passes, iterations)
+                           for num_topics in wave for seed in seeds]
+                for future in futures:
+                    results.extend(future.result())
+                wave_df = pd.DataFrame(results)
+                for num_topics in wave:
+                    score = wave_df[(wave_df['num_topics'] == num_topics) &
+                                    (wave_df['scoring_method'] == scoring_methods[0])]['coherence'].mean()
+                    logging.info("\t{0} topics - {1}: {2:.4f}".format(num_topics, scoring_methods[0], score))
+                    if best is None or score > best + min_delta:
+                        best, best_at = score, num_topics
+                if patience is not None and wave[-1] - best_at >= patience:
+                    logging.info("coherence plateaued after {} topics, the sweep is stopped".format(best_at))
+                    break
+        return pd.DataFrame(results).sort_values(['num_topics', 'seed', 'scoring_method']).reset_index(drop=True)
+
+    def plot_optimal_coherent_scores(self, scoring_method="c_v", start_range=1, end_range=15, workers=None,
+                                     seeds=(100,), patience=None):
+        import matplotlib.pyplot as plt
+        results = self.coherence_sweep(start_range, end_range, scoring_methods=(scoring_method,), seeds=seeds,
+                                       workers=workers, patience=patience)
+        scores = results.groupby('num_topics')['coherence'].mean()
+        plt.plot(list(scores.index), list(scores.values))
         plt.xlabel('Number of Topics (from {0} to {1})'.format(start_range, end_range))
         plt.ylabel('Coherence Score {}'.format(scoring_method))
         plt.show()
+        return results
 
-    def create_lda_model(self, num_topic, iteration=100):
+    def create_lda_model(self, num_topic, iteration=100, passes=100, chunksize=2000, workers=4):
+        # the corpus is read chunk by chunk, so a streamed (MmCorpus) bag of words keeps the memory flat
+        from gensim.models import LdaMulticore
         lda_model = LdaMulticore(corpus=self.bow_corpus,
                                  id2word=self.dictionary,
                                  iterations=iteration,
                                  num_topics=num_topic,
-                                 workers=4,
-                                 passes=100)
+                                 workers=workers,
+                                 chunksize=chunksize,
+                                 passes=passes)
         lda_model.print_topics(-1)
         self.lda_model = lda_model
 
     def create_hdp_model(self):
+        from gensim.models import HdpModel
         hdp_model = HdpModel(corpus=self.bow_corpus,
                              id2word=self.dictionary,)
         hdp_model.print_topics(-1)
         self.hdp_model = hdp_model
 
 
-    def format_topics_sentences(self, use_lda_model=True):
+    @staticmethod
+    def infer_document_topics(model, bow_corpus, chunksize=2000):
+        # dense document-topic matrix, the documents are inferred chunk by chunk
+        documents = iter(bow_corpus)
+        chunks = []
+        chunk = list(islice(documents, chunksize))
+        while chunk:
+            gamma = model.inference(chunk)
+            if isinstance(gamma, tuple):  # LdaModel returns (gamma, sstats), HdpModel only gamma
+                gamma = gamma[0]
+            chunks.append(gamma)
+            chunk = list(islice(documents, chunksize))
+        if not chunks:
+            return np.zeros((0, 0))
+        gamma = np.vstack(chunks)
+        totals = gamma.sum(axis=1, keepdims=True)
+        # empty documents (all zero gamma in HDP) keep an all zero row
+        return np.divide(gamma, totals, out=np.zeros_like(gamma), where=totals > 0)
+
+    @staticmethod
+    def label_topics(model, doc_topics, index=None):
+        # dominant topic, its contribution and its keywords for every document of the matrix
+        # an empty matrix (no document) gives an empty frame with the same columns
+        if doc_topics.size > 0:
+            dominant = doc_topics.argmax(axis=1)
+        else:
+            dominant = np.zeros(len(doc_topics), dtype=np.int64)
+        contribution = doc_topics[np.arange(len(doc_topics)), dominant]
+        keywords = np.empty(doc_topics.shape[1], dtype=object)
+        for topic_num in np.unique(dominant):
+            keywords[topic_num] = ", ".join([word for word, prop in model.show_topic(topic_num)])
+        topics_df = pd.DataFrame({'dominant_topic': pd.array(dominant + 1, dtype='Int64'),
+                                  'perc_contribution': contribution.round(4),
+                                  'topic_keywords': keywords[dominant]}, index=index)
+        empty = contribution == 0
+        if empty.any():
+            topics_df.loc[empty, 'dominant_topic'] = pd.NA
+            topics_df.loc[empty, 'topic_keywords'] = None
+        return topics_df
+
+    def format_topics_sentences(self, use_lda_model=True, chunksize=2000):
         model = None
         if use_lda_model:
             model = self.lda_model
@@ -89,22 +442,103 @@ class LDAModel:
         else:
             model = self.hdp_model
             logging.info("using HDP model to label topics for paragraphs")
-        # empty data frame
-        sent_topics_df = pd.DataFrame()
-        # retrieve main topic for each document
-        for i, row_list in enumerate(model[self.bow_corpus]):
-            row = row_list[0] if model.per_word_topics else row_list
-            row = sorted(row, key=lambda x: (x[1]), reverse=True)
-            # Get the dominant topic, percentage of contribution and the set of keywords for each document
-            for j, (topic_num, prop_topic) in enumerate(row):
-                if j == 0:  # => dominant topic
-                    wp = model.show_topic(topic_num)
-                    topic_keywords = ", ".join([word for word, prop in wp])
-                    sent_topics_df = pd.concat([sent_topics_df, pd.DataFrame(
-                        [pd.Series([int(topic_num)+1, round(prop_topic, 4), topic_keywords])])], ignore_index=True)
-                else:
-                    break
-        sent_topics_df.columns = ['dominant_topic', 'perc_contribution', 'topic_keywords']
-
-        self.df = pd.concat([self.df, sent_topics_df], axis=1)
+        self.doc_topic_matrix = LDAModel.infer_document_topics(model, self.bow_corpus, chunksize)
+        sent_topics_df = LDAModel.label_topics(model, self.doc_topic_matrix, self.df.index)
+        # labelling again replaces the columns of the previous run
+        self.df = pd.concat([self.df.drop(columns=TOPIC_COLUMNS, errors='ignore'), sent_topics_df], axis=1)
         logging.info("tagging topics are done, check the dataframe in LDAModel object\n")
+
+    def transform(self, data, use_lda_model=True, batch_size=2000):
+        # labels new paragraphs with the trained model, neither the model nor the preprocessor is changed
+        frames = list(self.iter_transform(data, use_lda_model, batch_size))
+        if len(frames) == 0:
+            # nothing to label, the empty frame still has the topic columns
+            batch = data.iloc[0:0] if isinstance(data, pd.DataFrame) else pd.DataFrame({'paragraph': []}, dtype=object)
+            topics_df = LDAModel.label_topics(None, np.zeros((0, 0)), batch.index)
+            return pd.concat([batch.drop(columns=TOPIC_COLUMNS, errors='ignore'), topics_df], axis=1)
+        return pd.concat(frames)
+
+    def iter_transform(self, data, use_lda_model=True, batch_size=2000):
+        # streaming variant of transform: data (a dataframe or any iterable of paragraphs) is labelled batch by batch
+        model = self.lda_model if use_lda_model else self.hdp_model
+        if model is None:
+            raise ValueError('the {} model is not trained yet'.format('LDA' if use_lda_model else 'HDP'))
+        if isinstance(data, pd.DataFrame):
+            batches = (data.iloc[start:start + batch_size] for start in range(0, len(data), batch_size))
+        else:
+            batches = LDAModel.text_batches(data, batch_size)
+        for batch in batches:
+            processed = self.processor.process_texts(batch['paragraph'])
+            bow_corpus = [self.dictionary.doc2bow(doc) for doc in processed]
+            doc_topics = LDAModel.infer_document_topics(model, bow_corpus, batch_size)
+            topics_df = LDAModel.label_topics(model, doc_topics, batch.index)
+            yield pd.concat([batch.drop(columns=TOPIC_COLUMNS, errors='ignore'), topics_df], axis=1)
+
+    @staticmethod
+    def text_batches(texts, batch_size):
+        texts = iter(texts)
+        start = 0
+        batch = list(islice(texts, batch_size))
+        while batch:
+            yield pd.DataFrame({'paragraph': batch}, index=pd.RangeIndex(start, start + len(batch)))
+            start += len(batch)
+            batch = list(islice(texts, batch_size))
+
+    def save(self, directory):
+        # numpy arrays of the models are stored in separate files, so that they can be memory-mapped on load
+        from gensim.corpora import MmCorpus
+        os.makedirs(directory, exist_ok=True)
+        # a single pickle, the token lists shared by the dataframe and the processor are stored once
+        with open(os.path.join(directory, 'state.pkl'), 'wb') as fp:
+            pickle.dump({'df': self.df,
+                         'processor': self.processor,
+                         'fingerprint': self.fingerprint,
+                         'bow_fingerprint': self.bow_fingerprint}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.dictionary is not None:
+            self.dictionary.save(os.path.join(directory, 'dictionary'))
+        bow_file = os.path.join(directory, 'bow.mm')
+        if not isinstance(self.bow_corpus, MmCorpus) or \
+                os.path.abspath(self.bow_corpus.input) != os.path.abspath(bow_file):
+            MmCorpus.serialize(bow_file, self.bow_corpus, id2word=self.dictionary)
+        if self.lda_model is not None:
+            self.lda_model.save(os.path.join(directory, 'lda_model'), sep_limit=0)
+        if self.hdp_model is not None:
+            self.hdp_model.save(os.path.join(directory, 'hdp_model'), sep_limit=0)
+        if self.doc_topic_matrix is not None:
+            np.save(os.path.join(directory, 'doc_topic_matrix.npy'), self.doc_topic_matrix)
+        logging.info("LDA model is saved to {}".format(directory))
+
+    @classmethod
+    def load(cls, directory, mmap='r', warm_start=False, artifact_dir=None):
+        # mmap='r' shares the arrays read-only between processes, a warm start needs writable (copy on write) arrays
+        from gensim.corpora import MmCorpus
+        from gensim.corpora.dictionary import Dictionary
+        from gensim.models import HdpModel, LdaModel
+        if warm_start:
+            mmap = 'c'
+        with open(os.path.join(directory, 'state.pkl'), 'rb') as fp:
+            state = pickle.load(fp)
+        model = cls(state['df'], artifact_dir)
+        model.saved_directory = directory
+        model.read_only = mmap == 'r'
+        model.processor = state['processor']
+        model.fingerprint = state['fingerprint']
+        model.bow_fingerprint = state['bow_fingerprint']
+        if model.processor is not None:
+            model.processed = model.processor.processed
+        if os.path.exists(os.path.join(directory, 'dictionary')):
+            model.dictionary = Dictionary.load(os.path.join(directory, 'dictionary'))
+        if os.path.exists(os.path.join(directory, 'bow.mm')):
+            model.bow_corpus = MmCorpus(os.path.join(directory, 'bow.mm'))
+            if warm_start:
+                # the online update extends the bag of words in memory
+                model.bow_corpus = [[(word_id, int(count)) for word_id, count in bow] for bow in model.bow_corpus]
+        if os.path.exists(os.path.join(directory, 'lda_model')):
+            # also restores the state and the id2word saved next to the model, LdaMulticore keeps its class
+            model.lda_model = LdaModel.load(os.path.join(directory, 'lda_model'), mmap=mmap)
+        if os.path.exists(os.path.join(directory, 'hdp_model')):
+            model.hdp_model = HdpModel.load(os.path.join(directory, 'hdp_model'), mmap=mmap)
+        if os.path.exists(os.path.join(directory, 'doc_topic_matrix.npy')):
+            model.doc_topic_matrix = np.load(os.path.join(directory, 'doc_topic_matrix.npy'), mmap_mode=mmap)
+        logging.info("LDA model is loaded from {}".format(directory))
+        return model
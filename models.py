@@ -0,0 +1,43 @@
+import logging
+import threading
+
+# process-wide registry, every model is loaded at most once and only when it is first needed
+_models = {}
+_lock = threading.Lock()
+
+
+def get_model(key, loader):
+    with _lock:
+        if key not in _models:
+            logging.info('loading model: {}'.format(key))
+            _models[key] = loader()
+        return _models[key]
+
+
+def spacy_model(name='en_core_web_md'):
+    def load():
+        import spacy
+        return spacy.load(name)
+    return get_model(('spacy', name), load)
+
+
+def sentencizer():
+    def load():
+        from spacy.lang.en import English
+        nlp = English()
+        nlp.add_pipe('sentencizer')
+        return nlp
+    return get_model(('spacy', 'sentencizer'), load)
+
+
+def flair_classifier(name='sentiment'):
+    def load():
+        from flair.nn import Classifier
+        return Classifier.load(name)
+    return get_model(('flair', name), load)
+
+
+def stop_words():
+    # same set as en_core_web_md's Defaults.stop_words, without loading the model
+    from spacy.lang.en.stop_words import STOP_WORDS
+    return STOP_WORDS
@@ -1,17 +1,21 @@
-from collections import defaultdict
+from collections import Counter
 import re
-import en_core_web_md
 import pandas as pd
-from gensim.models import Phrases
-from gensim.models.phrases import Phraser
 
 import logging
 
+import models
+
 RE_COMBINE_WHITESPACE = re.compile(r"\s+")
+# the only components needed for pos_, is_stop and is_alpha, the rest of the pipeline is disabled
+SPACY_TOKENIZER_PIPES = ['tok2vec', 'tagger', 'attribute_ruler']
+# runs of unwanted characters and whitespaces are replaced by a single space in one regex pass
+RE_UNWANTED_CHARACTERS = re.compile("[" + re.escape("!@#$%^&*()[]{};:,./<>?\\|`~-=_+1234567890") + r"\s]+")
 
 
 class Processor:
-    def __init__(self, corpus, simple_tokenizer=True, custom_stopwords=[]):
+    def __init__(self, corpus, simple_tokenizer=True, custom_stopwords=[], n_process=1, batch_size=1000,
+                 reuse_tokens=False):
         logging.info("Preprocessor initiated...")
         if isinstance(corpus, list):
             self.raw = corpus
@@ -20,26 +24,15 @@ class Processor:
             self.raw = list(corpus['paragraph'])
             self.df = corpus
         self.corpus = []
-        self.custom_stopwords = custom_stopwords
-
-        self.nlp = en_core_web_md.load()
-
-        # adding custom stopwords to the set
-        stopwords = self.nlp.Defaults.stop_words
-        logging.info("\tstopwords length (standard): {}".format(len(stopwords)))
-        stopwords = list(stopwords)
-        stopwords.extend(self.custom_stopwords)
-        self.stopwords = stopwords
-        logging.info("\tstopwords length: {}".format(len(self.stopwords)))
-
+        self.init_state(simple_tokenizer, custom_stopwords, n_process, batch_size)
         self.pre_tokenize()
-        self.processed = None
 
-        self.wfrequencies = defaultdict(int)
-        if simple_tokenizer:
-            self.tokens = [[word.strip() for word in document.lower().split() if
-                            word.strip() not in self.stopwords and len(word.strip()) > 2]
-                           for document in self.corpus]
+        if reuse_tokens and self.df is not None and 'tokens' in self.df.columns and self.df['tokens'].notna().all():
+            # already tokenized with the same settings (e.g. loaded from a BookStore), no need to tokenize again
+            self.tokens = list(self.df['tokens'])
+            logging.info("\ttokens are reused from the dataframe")
+        elif simple_tokenizer:
+            self.tokens = self.tokenize(self.corpus)
         else:
             self.spacy_tokenizer()
         logging.info("\ttokenization and initial preprocessing is done")
@@ -47,58 +40,255 @@ class Processor:
         logging.info("\tword count is done:")
         logging.info("\t\t{}\n".format(self.filter_wfrequencies()))
 
+    def init_state(self, simple_tokenizer, custom_stopwords, n_process, batch_size):
+        # settings and (empty) preprocessing results, shared with StreamingProcessor
+        self.custom_stopwords = custom_stopwords
+
+        # adding custom stopwords to the set
+        stopwords = models.stop_words()
+        logging.info("\tstopwords length (standard): {}".format(len(stopwords)))
+        self.stopwords = frozenset(stopwords).union(self.custom_stopwords)
+        logging.info("\tstopwords length: {}".format(len(self.stopwords)))
+
+        self.simple_tokenizer = simple_tokenizer
+        self.n_process = n_process
+        self.batch_size = batch_size
+        self.processed = None
+        self.sentences = None
+        self.min_freq = None
+        self.max_freq = None
+        self.bigram_mod = None
+        self.trigram_mod = None
+        self.wfrequencies = Counter()
+
+    @property
+    def nlp(self):
+        # only loaded on first use, i.e. never with the simple tokenizer unless sentences are split
+        return models.spacy_model('en_core_web_md')
+
     def add_stop_words(self, stop_words_list):
         self.custom_stopwords.extend(stop_words_list)
 
+    @staticmethod
+    def normalize(text):
+        return RE_UNWANTED_CHARACTERS.sub(" ", text)
+
+    @staticmethod
+    def simple_tokenize(document, stopwords):
+        # split() already strips the words, no need to strip them again
+        return [word for word in document.lower().split() if len(word) > 2 and word not in stopwords]
+
     def pre_tokenize(self):
         for text in self.raw:
-            tmp = text.translate({ord(c): " " for c in "!@#$%^&*()[]{};:,./<>?\\|`~-=_+1234567890"})
-            tmp = RE_COMBINE_WHITESPACE.sub(" ", tmp)
-            self.corpus.append(tmp)
+            self.corpus.append(Processor.normalize(text))
         logging.info("\tAll paragraph are normalized by removing unwanted characters")
 
-    def spacy_tokenizer(self):
+    def tokenize(self, documents):
+        if self.simple_tokenizer:
+            return [Processor.simple_tokenize(document, self.stopwords) for document in documents]
+        return self.spacy_tokenize(documents)
+
+    def spacy_tokenize(self, documents):
+        return list(self.iter_spacy_tokens(documents))
+
+    def iter_spacy_tokens(self, documents):
         # POS tags to remove
         removal = ['ADV', 'PRON', 'CCONJ', 'PUNCT', 'PART', 'DET', 'ADP', 'SPACE', 'NUM', 'SYM']
 
-        self.tokens = []
-        for summary in self.nlp.pipe(self.corpus):
-            proj_tok = [token.text.lower() for token in summary if
-                        token.pos_ not in removal and not token.is_stop and token.is_alpha and
-                        token.text.lower() not in self.stopwords]
-            self.tokens.append(proj_tok)
+        enabled = [pipe for pipe in SPACY_TOKENIZER_PIPES if pipe in self.nlp.pipe_names]
+        with self.nlp.select_pipes(enable=enabled):
+            # docs are streamed, only their filtered tokens are kept
+            for summary in self.nlp.pipe(documents, n_process=self.n_process, batch_size=self.batch_size):
+                yield [token.text.lower() for token in summary if
+                       token.pos_ not in removal and not token.is_stop and token.is_alpha and
+                       token.text.lower() not in self.stopwords]
+
+    def spacy_tokenizer(self):
+        self.tokens = self.spacy_tokenize(self.corpus)
         logging.info("Spacy listed POS removal and stopwords removal are done...")
 
+    def split_sentences(self, paragraphs=None):
+        # same rule based sentencizer pipeline as Sentiment, so the sentences can be reused there
+        if paragraphs is None:
+            paragraphs = self.raw
+        if paragraphs is None:
+            raise ValueError('the raw paragraphs are not kept by this preprocessor, pass them to split_sentences')
+        nlp = models.sentencizer()
+        self.sentences = [[sent.text for sent in doc.sents]
+                          for doc in nlp.pipe(paragraphs, n_process=self.n_process, batch_size=self.batch_size)]
+        logging.info("\tparagraphs are split into sentences")
+        return self.sentences
+
     def preprocess(self, force=False, min_freq=5, max_freq=200):
         if self.processed is None or force:
+            from gensim.models.phrases import Phrases, Phraser
             print('preprocessing workflow started...')
-            # Only keep words that appear more than five times and repeated less than 200 times
-            self.processed = [[token for token in text if max_freq > self.wfrequencies[token] > min_freq]
-                              for text in self.tokens]
+            self.min_freq = min_freq
+            self.max_freq = max_freq
             # bigrams and trigrams
             bigram = Phrases(self.tokens, min_count=5, threshold=100)  # higher threshold fewer phrases.
             trigram = Phrases(bigram[self.tokens], threshold=100)
-            bigram_mod = Phraser(bigram)
-            trigram_mod = Phraser(trigram)
+            self.bigram_mod = Phraser(bigram)
+            self.trigram_mod = Phraser(trigram)
             logging.info("analyzing bigrams and trigrams")
-            self.processed = [bigram_mod[doc] for doc in self.processed]
-            self.processed = [trigram_mod[bigram_mod[doc]] for doc in self.processed]
+            self.processed = self.process(self.tokens)
         logging.info("\tPreprocessing done...\n")
         return self.processed
 
-    def count_word_frequencies(self, refresh=False):
+    def artifacts(self):
+        return {'tokens': self.tokens, 'processed': self.processed, 'sentences': self.sentences,
+                'min_freq': self.min_freq, 'max_freq': self.max_freq,
+                'bigram_mod': self.bigram_mod, 'trigram_mod': self.trigram_mod}
+
+    def restore(self, artifacts):
+        # restores the preprocessing results saved by artifacts(), nothing is recomputed
+        self.tokens = artifacts['tokens']
+        self.processed = artifacts['processed']
+        self.sentences = artifacts['sentences']
+        self.min_freq = artifacts['min_freq']
+        self.max_freq = artifacts['max_freq']
+        self.bigram_mod = artifacts['bigram_mod']
+        self.trigram_mod = artifacts['trigram_mod']
+
+    def process(self, tokens):
+        return [self.process_document(text) for text in tokens]
+
+    def process_document(self, text):
+        # Only keep words that appear more than five times and repeated less than 200 times
+        processed = [token for token in text if self.max_freq > self.wfrequencies[token] > self.min_freq]
+        return self.trigram_mod[self.bigram_mod[self.bigram_mod[processed]]]
+
+    def process_texts(self, texts):
+        # new texts go through the same normalization, tokenizer, frequency filter and phrasers, nothing is updated
+        tokens = self.tokenize([Processor.normalize(text) for text in texts])
+        return [self.process_document(text) for text in tokens]
+
+    def extend(self, corpus):
+        # tokenize and process only the new documents, reusing the stopwords, frequencies and phrasers
+        if isinstance(corpus, pd.DataFrame):
+            raw = list(corpus['paragraph'])
+        else:
+            raw = list(corpus)
+        normalized = [Processor.normalize(text) for text in raw]
+        tokens = self.tokenize(normalized)
+        self.raw.extend(raw)
+        self.corpus.extend(normalized)
+        self.tokens.extend(tokens)
+        self.count_word_frequencies(tokens=tokens)
+        processed = None
+        if self.processed is not None:
+            processed = self.process(tokens)
+            self.processed.extend(processed)
+        if isinstance(corpus, pd.DataFrame) and self.df is not None:
+            corpus = corpus.copy()
+            corpus['tokens'] = tokens
+            if processed is not None:
+                corpus['processed'] = processed
+            self.df = pd.concat([self.df, corpus], ignore_index=True)
+        logging.info("\t{} new documents are added to the preprocessor".format(len(raw)))
+        return processed
+
+    def count_word_frequencies(self, refresh=False, tokens=None):
         if refresh:
-            self.wfrequencies = defaultdict(int)
-        for text in self.tokens:
-            for token in text:
-                if token.lower not in self.stopwords:
-                    self.wfrequencies[token] += 1
+            self.wfrequencies = Counter()
+        if tokens is None:
+            tokens = self.tokens
+        stopwords = self.stopwords
+        self.wfrequencies.update(token for text in tokens for token in text if token.lower() not in stopwords)
 
     def map_to_df(self):
         if self.df is not None:
             self.df['tokens'] = self.tokens
+            if self.sentences is not None:
+                self.df['sentences'] = self.sentences
             if self.processed is not None:
                 self.df['processed'] = self.processed
 
     def filter_wfrequencies(self, threshold=150):
         return {k: v for (k, v) in self.wfrequencies.items() if v > threshold}
+
+
+class TokenSpill:
+    def __init__(self, file_name):
+        # one tokenized document per line, tokens are separated by a single space
+        self.file_name = file_name
+        self.length = 0
+
+    def write(self, documents):
+        self.length = 0
+        self.append(documents, mode='w')
+
+    def append(self, documents, mode='a'):
+        with open(self.file_name, mode, encoding='utf-8') as fp:
+            for tokens in documents:
+                fp.write(' '.join(tokens))
+                fp.write('\n')
+                self.length += 1
+
+    def __iter__(self):
+        with open(self.file_name, 'r', encoding='utf-8') as fp:
+            for line in fp:
+                yield line.split()
+
+    def __len__(self):
+        return self.length
+
+
+class ProcessedStream:
+    def __init__(self, processor, tokens):
+        # restartable: every iteration processes the spilled tokens again
+        self.processor = processor
+        self.tokens = tokens
+
+    def __iter__(self):
+        for text in self.tokens:
+            yield self.processor.process_document(text)
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+class StreamingProcessor(Processor):
+    def __init__(self, corpus, simple_tokenizer=True, custom_stopwords=[], spill_file='out/tokens.txt',
+                 n_process=1, batch_size=1000):
+        logging.info("Streaming preprocessor initiated...")
+        # corpus can be any iterable of paragraphs, e.g. ColumnarCorpus.paragraphs()
+        if isinstance(corpus, pd.DataFrame):
+            corpus = corpus['paragraph']
+        # neither the paragraphs nor a dataframe are kept
+        self.raw = None
+        self.df = None
+        self.init_state(simple_tokenizer, custom_stopwords, n_process, batch_size)
+
+        # a single pass: tokenize, count the frequencies and spill the tokens to the disk
+        self.tokens = TokenSpill(spill_file)
+        self.tokens.write(self.count_stream(self.tokenize_stream(corpus)))
+        logging.info("\t{0} tokenized documents are spilled to {1}".format(len(self.tokens), spill_file))
+        logging.info("\t\t{}\n".format(self.filter_wfrequencies()))
+
+    def tokenize_stream(self, paragraphs):
+        documents = (Processor.normalize(text) for text in paragraphs)
+        if self.simple_tokenizer:
+            for document in documents:
+                yield Processor.simple_tokenize(document, self.stopwords)
+        else:
+            yield from self.iter_spacy_tokens(documents)
+
+    def count_stream(self, documents):
+        for tokens in documents:
+            self.count_word_frequencies(tokens=[tokens])
+            yield tokens
+
+    def process(self, tokens):
+        return ProcessedStream(self, tokens)
+
+    def extend(self, corpus):
+        # the new tokens are appended to the spill, so the processed stream covers them too
+        if isinstance(corpus, pd.DataFrame):
+            corpus = corpus['paragraph']
+        tokens = list(self.tokenize_stream(corpus))
+        self.tokens.append(self.count_stream(tokens))
+        logging.info("\t{} new documents are added to the preprocessor".format(len(tokens)))
+        if self.processed is not None:
+            return self.process(tokens)
+        return None
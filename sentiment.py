@@ -1,41 +1,209 @@
+import ast
 import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
-from flair.data import Sentence
-from flair.nn import Classifier
-from spacy.lang.en import English
+
+import models
+from cache import SentimentCache
+
+
+PARAGRAPH_KEYS = ['book', 'chapter', 'paragraph_number']
+# one row per sentence, stored next to the paragraph table
+SENTENCE_COLUMNS = PARAGRAPH_KEYS + ['sentence_number', 'sentence_prec', 'sentence_sentiment',
+                                     'sentence_sentiment_score']
+
+# the sentiment model of each worker process, loaded once by the pool initializer
+_worker_sentiment = None
+
+
+def _init_worker(fast, threads_per_worker, cache_file, cache_max_entries):
+    global _worker_sentiment
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    cache = None
+    if cache_file is not None:
+        cache = SentimentCache(cache_file, cache_max_entries)
+    _worker_sentiment = Sentiment(pd.DataFrame(), fast=fast, cache=cache)
+
+
+def _predict_shard(paragraphs, mini_batch_size, sentences=None):
+    cache = _worker_sentiment.cache
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    sentiments, details = _worker_sentiment.batch_predict(paragraphs, mini_batch_size, sentences)
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return sentiments, details, hits, misses
 
 
 class Sentiment:
-    def __init__(self, df, fast=False):
+    def __init__(self, df, fast=False, cache=None):
         self.df = df
-        self.nlp = English()
-        self.nlp.add_pipe('sentencizer')
-        # load the model
-        if fast:
-            self.tagger = Classifier.load('sentiment-fast')
-        else:
-            self.tagger = Classifier.load('sentiment')
+        # sentence level sentiments (SENTENCE_COLUMNS), filled by predict
+        self.sentence_df = None
+        self.fast = fast
+        # optional SentimentCache, consulted before running the classifier on a sentence
+        self.cache = cache
+        self.nlp = models.sentencizer()
+        # load the model (shared by all the Sentiment objects of the process)
+        self.model_name = 'sentiment-fast' if fast else 'sentiment'
+        self.tagger = models.flair_classifier(self.model_name)
 
-    def predict(self, load_from_file=False, file_name='out/sentiment.csv'):
+    def predict(self, load_from_file=False, file_name='out/sentiment.csv', batched=True, mini_batch_size=32,
+                workers=1, threads_per_worker=1, sentences_file=None):
+        if sentences_file is None:
+            sentences_file = Sentiment.sentences_file_name(file_name)
         if load_from_file:
             logging.info("loading sentiments from already exported file:\n\t{}".format(file_name))
             tmp_df = pd.read_csv(file_name)
             len_before = len(self.df)
-            tmp_df = tmp_df[['book', 'chapter', 'paragraph_number', 'sentiment',
-                             'sentiment_details']]
+            # files exported before the sentence table existed also have the stringified sentiment_details
+            tmp_df = tmp_df[[column for column in PARAGRAPH_KEYS + ['sentiment', 'sentiment_details']
+                             if column in tmp_df.columns]]
             self.df = pd.merge(self.df, tmp_df, how='left',
                                left_on=['book', 'chapter', 'paragraph_number'],
                                right_on=['book', 'chapter', 'paragraph_number'])
             logging.info("left join done and sentiments are loaded - check: {0}=={1}?".format(len_before, len(self.df)))
+            if os.path.exists(sentences_file):
+                self.sentence_df = pd.read_parquet(sentences_file)
+                Sentiment.check_sentence_keys(tmp_df, self.sentence_df, sentences_file)
+                logging.info("sentence level sentiments are loaded from:\n\t{}".format(sentences_file))
+            elif 'sentiment_details' in self.df.columns:
+                self.sentence_df = Sentiment.create_sentence_df(self.df, self.df['sentiment_details'])
+            return
+        elif workers > 1:
+            logging.info('start computing the sentiments with {} worker processes'.format(workers))
+            self.df['sentiment'], self.df['sentiment_details'] = \
+                self.parallel_predict(workers, mini_batch_size, threads_per_worker)
+        elif batched:
+            logging.info('start computing the sentiments in mini-batches of {} sentences'.format(mini_batch_size))
+            self.df['sentiment'], self.df['sentiment_details'] = \
+                self.batch_predict(list(self.df['paragraph']), mini_batch_size, self.presplit_sentences())
         else:
             logging.info('start computing the sentiments - the process will take time, be patient')
             self.df['sentiment'], self.df['sentiment_details'] = \
                 zip(*self.df['paragraph'].apply(lambda x: self.single_predict(x)))
+        self.sentence_df = Sentiment.create_sentence_df(self.df, self.df['sentiment_details'])
+
+    @staticmethod
+    def sentences_file_name(file_name):
+        # the sentence table is stored next to the paragraph csv, e.g. out/sentiment_sentences.parquet
+        return os.path.splitext(file_name)[0] + '_sentences.parquet'
+
+    @staticmethod
+    def check_sentence_keys(paragraph_df, sentence_df, sentences_file):
+        # the sentence table must come from the same run as the paragraph csv: no sentence of an unknown
+        # paragraph, and sentences for every paragraph with a positive or negative sentiment
+        keys = [key for key in PARAGRAPH_KEYS if key in paragraph_df.columns and key in sentence_df.columns]
+        paragraphs = pd.MultiIndex.from_frame(paragraph_df[keys])
+        with_sentences = pd.MultiIndex.from_frame(sentence_df[keys])
+        unknown = (~with_sentences.isin(paragraphs)).sum()
+        missing = (~paragraphs[(paragraph_df['sentiment'] != 'NEUTRAL').to_numpy()].isin(with_sentences)).sum()
+        if unknown > 0 or missing > 0:
+            raise ValueError('{0} does not match the paragraph sentiments: {1} sentences of unknown paragraphs, '
+                             '{2} paragraphs without sentences'.format(sentences_file, unknown, missing))
+
+    @staticmethod
+    def create_sentence_df(df, details):
+        # details are the per paragraph dicts of the sentences, or their repr strings in legacy csv files
+        parsed = []
+        for detail in details:
+            if isinstance(detail, str):
+                detail = ast.literal_eval(detail)
+            parsed.append(detail if isinstance(detail, dict) else {})
+        rows = [(int(idx), info['len'], info['tag'], info['score'])
+                for detail in parsed for idx, info in detail.items()]
+        sentence_df = pd.DataFrame(rows, columns=SENTENCE_COLUMNS[len(PARAGRAPH_KEYS):])
+        # the paragraph keys are repeated once per sentence
+        positions = np.repeat(np.arange(len(df)), [len(detail) for detail in parsed])
+        keys = df[[key for key in PARAGRAPH_KEYS if key in df.columns]].iloc[positions].reset_index(drop=True)
+        return pd.concat([keys, sentence_df], axis=1)
+
+    def presplit_sentences(self):
+        # sentences already split by the Processor (LDAModel.preprocess(split_sentences=True))
+        if 'sentences' in self.df.columns and self.df['sentences'].notna().all():
+            return list(self.df['sentences'])
+        return None
+
+    def batch_predict(self, paragraphs, mini_batch_size=32, sentences=None):
+        from flair.data import Sentence
+        if sentences is None:
+            sentences = [[sent.text for sent in nlp_paragraph.sents] for nlp_paragraph in self.nlp.pipe(paragraphs)]
+        # flatten all the sentences of all the paragraphs with (row, sentence_idx) back-pointers
+        texts = []
+        pointers = []
+        for row, paragraph_sentences in enumerate(sentences):
+            for idx, sent in enumerate(paragraph_sentences):
+                texts.append(sent)
+                pointers.append((row, idx))
+        logging.info("\t{0} sentences are extracted from {1} paragraphs".format(len(texts), len(paragraphs)))
+
+        # every distinct sentence is scored once, either from the cache or by the classifier
+        predictions = {}
+        unique_texts = list(dict.fromkeys(texts))
+        if self.cache is not None:
+            predictions = self.cache.lookup(unique_texts, self.model_name)
+            logging.info("\tcache: {}".format(self.cache.stats()))
+        missing = [text for text in unique_texts if text not in predictions]
+
+        # sorting by length keeps similar sentences in the same mini-batch and cuts the padding
+        missing.sort(key=len)
+        sentences = [Sentence(text) for text in missing]
+        if len(sentences) > 0:
+            self.tagger.predict(sentences, mini_batch_size=mini_batch_size)
+        predicted = {text: (sentence.tag, sentence.score) for text, sentence in zip(missing, sentences)}
+        if self.cache is not None:
+            self.cache.store(predicted, self.model_name)
+        predictions.update(predicted)
+
+        # scatter the predictions back to their paragraphs (in the original sentence order)
+        details = [{} for _ in paragraphs]
+        for i, (row, idx) in enumerate(pointers):
+            tag, score = predictions[texts[i]]
+            details[row][idx] = {'len': len(texts[i]) / len(paragraphs[row]),
+                                 'tag': tag,
+                                 'score': score}
+        return [Sentiment.aggregate(sentiments) for sentiments in details], details
+
+    def parallel_predict(self, workers, mini_batch_size=32, threads_per_worker=1):
+        # shard by book/chapter, keeping the row positions to merge the results back in the original order
+        keys = [key for key in ['book', 'chapter'] if key in self.df.columns]
+        if len(keys) > 0:
+            shards = list(self.df.groupby(keys, sort=False, dropna=False).indices.values())
+        else:
+            shards = [list(range(len(self.df)))]
+        paragraphs = list(self.df['paragraph'])
+        presplit = self.presplit_sentences()
+        sentiments = [None] * len(paragraphs)
+        details = [None] * len(paragraphs)
+        cache_file, cache_max_entries = None, None
+        if self.cache is not None:
+            cache_file, cache_max_entries = self.cache.file_name, self.cache.max_entries
+        # spawn (rather than fork) so that every worker starts with a clean torch state
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(self.fast, threads_per_worker, cache_file, cache_max_entries)) as executor:
+            results = executor.map(_predict_shard,
+                                   [[paragraphs[i] for i in shard] for shard in shards],
+                                   [mini_batch_size] * len(shards),
+                                   [None if presplit is None else [presplit[i] for i in shard] for shard in shards])
+            for shard, (shard_sentiments, shard_details, hits, misses) in zip(shards, results):
+                for i, sentiment, detail in zip(shard, shard_sentiments, shard_details):
+                    sentiments[i] = sentiment
+                    details[i] = detail
+                if self.cache is not None:
+                    self.cache.hits += hits
+                    self.cache.misses += misses
+        logging.info("\t{} shards are scored".format(len(shards)))
+        return sentiments, details
 
     def single_predict(self, paragraph):
+        from flair.data import Sentence
         sentiments = {}
-        tags = {'NEGATIVE': 0, 'POSITIVE': 0}
         nlp_paragraph = self.nlp(paragraph)
         idx = 0
         for sent in nlp_paragraph.sents:
@@ -44,20 +212,34 @@ class Sentiment:
             sentiments[idx] = {'len': len(sent.text) / len(paragraph),
                                'tag': sentence.tag,
                                'score': sentence.score}
-            tags[sentence.tag] += sentiments[idx]['len'] * sentiments[idx]['score']
             idx += 1
+        return Sentiment.aggregate(sentiments), sentiments
+
+    @staticmethod
+    def aggregate(sentiments):
+        tags = {'NEGATIVE': 0, 'POSITIVE': 0}
+        for sent_info in sentiments.values():
+            tags[sent_info['tag']] += sent_info['len'] * sent_info['score']
         if tags['POSITIVE'] == 0 and tags['NEGATIVE'] == 0:
-            return 'NEUTRAL', sentiments
+            return 'NEUTRAL'
         elif tags['POSITIVE'] == 0:
-            return 'NEGATIVE', sentiments
+            return 'NEGATIVE'
         elif tags['NEGATIVE'] == 0:
-            return 'POSITIVE', sentiments
+            return 'POSITIVE'
         elif tags['POSITIVE'] / tags['NEGATIVE'] >= 1.5:
-            return 'POSITIVE', sentiments
+            return 'POSITIVE'
         elif tags['NEGATIVE'] / tags['POSITIVE'] >= 1.5:
-            return 'NEGATIVE', sentiments
-        return 'NEUTRAL', sentiments
+            return 'NEGATIVE'
+        return 'NEUTRAL'
 
-    def export_to_csv(self, file_address='out/sentiment.csv'):
-        self.df.to_csv(file_address)
+    def export_to_csv(self, file_address='out/sentiment.csv', sentences_file=None):
+        # the sentence details are stored natively in their own table instead of a stringified column
+        if sentences_file is None:
+            sentences_file = Sentiment.sentences_file_name(file_address)
+        if self.sentence_df is not None:
+            self.sentence_df.to_parquet(sentences_file, index=False)
+            self.df.drop(columns=['sentiment_details'], errors='ignore').to_csv(file_address)
+            logging.info('sentence level sentiments are writen in {}'.format(sentences_file))
+        else:
+            self.df.to_csv(file_address)
         logging.info('file is writen successfully')
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+
+
+class BookStore:
+    def __init__(self, directory='out/books'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, book_name):
+        return os.path.join(self.directory, '{}.pkl'.format(re.sub(r'[^0-9A-Za-z]+', '_', book_name).strip('_')))
+
+    def load(self, book):
+        # the stored artifacts are only valid if the book is still segmented in the same way
+        path = self.path(book.book_name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as fp:
+            stored = pickle.load(fp)
+        if stored['fingerprint'] != book.fingerprint():
+            logging.info('\t{} has changed since it was stored'.format(book))
+            return None
+        return stored['df']
+
+    def save(self, book, df):
+        with open(self.path(book.book_name), 'wb') as fp:
+            pickle.dump({'fingerprint': book.fingerprint(), 'df': df}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def save_shelf(self, bookshelf, df):
+        for book in bookshelf.books:
+            book_df = df[df['book'] == book.book_name]
+            if len(book_df) > 0:
+                self.save(book, book_df.reset_index(drop=True))
+        logging.info('artifacts of the books are stored in {}'.format(self.directory))
+
+
+class ArtifactStore:
+    def __init__(self, directory='out/artifacts'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(texts, params):
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8'))
+        for text in texts:
+            digest.update(b'\x00')
+            digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, fingerprint, file_name):
+        directory = os.path.join(self.directory, fingerprint)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, file_name)
+
+    def has(self, fingerprint, name):
+        return os.path.exists(os.path.join(self.directory, fingerprint, name + '.pkl'))
+
+    def load(self, fingerprint, name):
+        with open(self.path(fingerprint, name + '.pkl'), 'rb') as fp:
+            return pickle.load(fp)
+
+    def save(self, fingerprint, name, artifact):
+        # written to a temporary file first, so that a partially written artifact is never loaded
+        path = self.path(fingerprint, name + '.pkl')
+        with open(path + '.tmp', 'wb') as fp:
+            pickle.dump(artifact, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        logging.info('\t{0} artifact is stored in {1}'.format(name, path))
@@ -1,20 +1,128 @@
+import hashlib
+import json
 import logging
 import math
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
-import json
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-import pyLDAvis.gensim_models
-import pyLDAvis
-from plotnine import *
+
+from cube import RollupCube
+from sentiment import Sentiment, PARAGRAPH_KEYS, SENTENCE_COLUMNS
+from store import ArtifactStore
+
+# finest grain of the rollup cubes, every report and treemap is a coarser view of them
+PARAGRAPH_CUBE_KEYS = ['book', 'chapter', 'dominant_topic', 'sentiment']
+SENTENCE_CUBE_KEYS = ['book', 'chapter', 'dominant_topic', 'sentence_sentiment']
+
+SENTIMENT_COLORS = {'(?)': 'lightgrey',
+                    'POSITIVE': "#b2e061",
+                    'NEUTRAL': "#7eb0d5",
+                    'NEGATIVE': "#fd7f6f"}
+
+# resolution and format of the figures rendered by Vis.render_all (the treemaps and the box plot are always html)
+RENDER_PRESETS = {
+    'draft': {'extension': 'png', 'dpi': 100, 'cloud_size': (1000, 720)},
+    'publication': {'extension': 'svg', 'dpi': 1200, 'cloud_size': (2500, 1800)},
+}
+
+# the plotting libraries are heavy to import, so they are imported lazily by the renderers using them
+# the renderers are module level functions (picklable for the process pool) drawing on their own figure objects
+
+
+def _init_render_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render_treemap(data, file_name, options):
+    import plotly.express as px
+    fig = px.treemap(data['df'], path=[px.Constant("bookshelf")] + data['path'],
+                     values='paragraph_number',
+                     color=data['color'],
+                     color_discrete_map=data['color_map'])
+    fig.update_layout(margin=dict(t=50, l=25, r=25, b=25))
+    fig.write_html(file_name)
+
+
+def _render_wordclouds(data, file_name, options):
+    # data['clouds'] is a list of (row, column, title, frequencies)
+    from matplotlib.figure import Figure
+    from wordcloud import WordCloud
+    width, height = options['cloud_size']
+    cloud = WordCloud(background_color='white',
+                      width=width,
+                      height=height,
+                      max_words=60,
+                      prefer_horizontal=1.0)
+    fig = Figure(figsize=(10, 10))
+    axes = fig.subplots(data['rows'], data['columns'], sharex=True, sharey=True, squeeze=False)
+    for row, column, title, frequencies in data['clouds']:
+        cloud.generate_from_frequencies(frequencies, max_font_size=height // 6)
+        axes[row, column].imshow(cloud)
+        axes[row, column].set_title(title, fontdict=dict(size=16))
+        axes[row, column].axis('off')
+    for row, column in data.get('empty', []):
+        fig.delaxes(axes[row, column])
+    fig.savefig(file_name, dpi=options['dpi'])
+
+
+def _render_density(data, file_name, options):
+    from plotnine import ggplot, aes, geom_density
+    fig = (ggplot(data['df'],
+                  aes(x='sentence_sentiment_score', color='sentence_sentiment', fill='sentence_sentiment'))
+           + geom_density(alpha=data['alpha'])
+           )
+    fig.save(file_name, dpi=options['dpi'], verbose=False)
+
+
+def _render_violin(data, file_name, options):
+    from matplotlib.figure import Figure
+    import seaborn as sns
+    fig = Figure()
+    ax = fig.subplots()
+    sns.boxplot(x='dominant_topic', y='sentence_sentiment_score', notch=True,
+                data=data['df'], showfliers=True, ax=ax)
+    ax.tick_params(axis='x', labelrotation=90)
+    fig.savefig(file_name, dpi=options['dpi'])
+
+
+def _boxplot_figure(data):
+    import plotly.express as px
+    fig = px.box(data['df'], x="dominant_topic", y="sentence_sentiment_score", color="sentence_sentiment")
+    fig.update_traces(quartilemethod="exclusive")
+    return fig
+
+
+def _render_boxplot(data, file_name, options):
+    _boxplot_figure(data).write_html(file_name)
+
+
+def _render_topic_columns(data, file_name, options):
+    from plotnine import ggplot, aes, geom_col, scale_x_continuous
+    fig = (ggplot(data['df'], aes('dominant_topic', 'sentence_number', fill='sentence_sentiment'))
+           + geom_col()
+           + scale_x_continuous()
+           )
+    fig.save(file_name, dpi=options['dpi'], verbose=False)
+
+
+def _render_pyldavis(data, file_name, options):
+    import pyLDAvis
+    pyLDAvis.save_html(data['prepared'], file_name)
+
+
+def _figure_fingerprint(renderer, data, options):
+    return hashlib.sha256(pickle.dumps((renderer.__name__, data, options), protocol=4)).hexdigest()
 
 
 class Vis:
     def __init__(self, sentiment, lda, notebook=False):
         if notebook:
+            import pyLDAvis
             pyLDAvis.enable_notebook()  # Visualise inside a notebook
         self.sentiment = sentiment
         self.lda = lda
@@ -24,292 +132,321 @@ class Vis:
             "#e60049", "#0bb4ff", "#50e991", "#e6d800", "#9b19f5", "#ffa300", "#dc0ab4", "#b3d4ff", "#00bfa0"
         ]
         self.sent_sentiment = self.create_detailed_sentiment_info()
-
-    def treemap_chapter_sentiments(self, file_name='figures/chapter_sentiments.html'):
-        df_tmp = self.df. \
-            groupby(['book', 'chapter', 'sentiment'], as_index=False). \
-            agg({'paragraph_number': ['count']})
-        df_tmp.columns = df_tmp.columns.droplevel(1)
-        fig = px.treemap(df_tmp, path=[px.Constant("bookshelf"), 'book', 'chapter', 'sentiment'],
-                         values='paragraph_number',
-                         color='sentiment',
-                         color_discrete_map={'(?)': 'lightgrey',
-                                             'POSITIVE': "#b2e061",
-                                             'NEUTRAL': "#7eb0d5",
-                                             'NEGATIVE': "#fd7f6f"})
-        fig.update_layout(margin=dict(t=50, l=25, r=25, b=25))
-        fig.write_html(file_name)
-        logging.info('chapter-sentiment treemap html file is saved in {}'.format(file_name))
-
-    def treemap_chapter_topic(self, file_name='figures/chapter_topic.html'):
-        df_tmp = self.df. \
-            groupby(['book', 'chapter', 'dominant_topic'], as_index=False). \
-            agg({'paragraph_number': ['count']})
-        df_tmp.columns = df_tmp.columns.droplevel(1)
+        self.paragraph_cube = RollupCube.from_frame(self.df, PARAGRAPH_CUBE_KEYS, 'perc_contribution')
+        self.sent_cube = RollupCube.from_frame(self.sent_sentiment, SENTENCE_CUBE_KEYS, 'sentence_sentiment_score')
+
+    def extend(self, df, sentence_df=None):
+        # new paragraphs (with their topics and sentiments) are appended, the cubes only aggregate the new rows
+        if sentence_df is None:
+            sentence_df = Sentiment.create_sentence_df(df, df['sentiment_details'])
+        sent_sentiment = Vis.join_sentence_topics(df, sentence_df)
+        self.df = pd.concat([self.df, df], ignore_index=True)
+        self.sent_sentiment = pd.concat([self.sent_sentiment, sent_sentiment], ignore_index=True)
+        self.paragraph_cube.update(df)
+        self.sent_cube.update(sent_sentiment)
+
+    def paragraph_counts(self, by):
+        return self.paragraph_cube.rollup(by)['rows'].rename('paragraph_number').reset_index()
+
+    def chapter_sentiments_data(self):
+        return {'df': self.paragraph_counts(['book', 'chapter', 'sentiment']),
+                'path': ['book', 'chapter', 'sentiment'],
+                'color': 'sentiment',
+                'color_map': SENTIMENT_COLORS}
+
+    def chapter_topic_data(self):
+        df_tmp = self.paragraph_counts(['book', 'chapter', 'dominant_topic'])
         df_tmp['dominant_topic'] = df_tmp['dominant_topic'].astype(str)
 
-        topics = list(self.df['dominant_topic'].unique())
+        topics = list(self.paragraph_cube.cells.index.unique('dominant_topic'))
         color_map = {'(?)': 'lightgrey'}
 
         for tid, t in enumerate(topics):
             color_map[str(t)] = self.colorset_treemap[tid]
+        return {'df': df_tmp,
+                'path': ['book', 'chapter', 'dominant_topic'],
+                'color': 'dominant_topic',
+                'color_map': color_map}
 
-        fig = px.treemap(df_tmp, path=[px.Constant("bookshelf"), 'book', 'chapter', 'dominant_topic'],
-                         values='paragraph_number',
-                         color='dominant_topic',
-                         color_discrete_map=color_map)
-        fig.update_layout(margin=dict(t=50, l=25, r=25, b=25))
-        fig.write_html(file_name)
+    def topic_sentiment_data(self):
+        return {'df': self.paragraph_counts(['book', 'dominant_topic', 'sentiment']),
+                'path': ['book', 'dominant_topic', 'sentiment'],
+                'color': 'sentiment',
+                'color_map': SENTIMENT_COLORS}
+
+    def treemap_chapter_sentiments(self, file_name='figures/chapter_sentiments.html'):
+        _render_treemap(self.chapter_sentiments_data(), file_name, {})
+        logging.info('chapter-sentiment treemap html file is saved in {}'.format(file_name))
+
+    def treemap_chapter_topic(self, file_name='figures/chapter_topic.html'):
+        _render_treemap(self.chapter_topic_data(), file_name, {})
         logging.info('chapter-topic treemap html is saved in: \n\t{}'.format(file_name))
 
     def treemap_topic_sentiment(self, file_name='figures/topic_sentiment.html'):
-        df_tmp = self.df. \
-            groupby(['book', 'dominant_topic', 'sentiment'], as_index=False). \
-            agg({'paragraph_number': ['count']})
-        df_tmp.columns = df_tmp.columns.droplevel(1)
-
-        fig = px.treemap(df_tmp, path=[px.Constant("bookshelf"), 'book',
-                                       'dominant_topic',
-                                       'sentiment'],
-                         values='paragraph_number',
-                         color='sentiment',
-                         color_discrete_map={'(?)': 'lightgrey',
-                                             'POSITIVE': "#b2e061",
-                                             'NEUTRAL': "#7eb0d5",
-                                             'NEGATIVE': "#fd7f6f"})
-        fig.update_layout(margin=dict(t=50, l=25, r=25, b=25))
-        fig.write_html(file_name)
+        _render_treemap(self.topic_sentiment_data(), file_name, {})
         logging.info('topic-sentiment treemap html is saved in: \n\t{}'.format(file_name))
 
-    def pyviz_topics(self, file_name='figures/pyvis_topics.html'):
-        lda_display = pyLDAvis.gensim_models.prepare(self.lda.lda_model,
-                                                     self.lda.bow_corpus,
-                                                     self.lda.dictionary,
-                                                     sort_topics=False)
-        pyLDAvis.save_html(lda_display, file_name)
+    def prepare_topics(self, n_jobs=-1, sample_docs=None, seed=0, cache_dir='out/pyldavis'):
+        # the inputs of pyLDAvis come from the trained model and the bag of words, nothing is inferred again
+        # when the document-topic matrix of format_topics_sentences is available (and matches the LDA model)
+        import pyLDAvis
+        from gensim.matutils import corpus2csc
+        lda_model = self.lda.lda_model
+        topic_term_dists = lda_model.get_topics()
+        vocab = [self.lda.dictionary[word_id] for word_id in range(len(self.lda.dictionary))]
+
+        # the cache key only depends on deterministic inputs: the topics, the vocabulary, the bag of words and
+        # the sampling, the (stochastic) document-topic inference is only run on a miss
+        digest = hashlib.sha256(json.dumps({'vocab': vocab, 'bow': self.lda.bow_fingerprint,
+                                            'sample_docs': sample_docs, 'seed': seed}).encode('utf-8'))
+        digest.update(np.ascontiguousarray(topic_term_dists, dtype=np.float64).tobytes())
+        if self.lda.bow_fingerprint is None:
+            # no stored fingerprint of the bag of words, its documents are hashed instead
+            for bow in self.lda.bow_corpus:
+                digest.update(np.asarray(bow, dtype=np.float64).tobytes())
+                digest.update(b'|')
+        fingerprint = digest.hexdigest()
+        store = ArtifactStore(cache_dir)
+        if store.has(fingerprint, 'prepared'):
+            logging.info('pyLDAvis data is reloaded: {}'.format(fingerprint))
+            return store.load(fingerprint, 'prepared')
+
+        counts = corpus2csc(self.lda.bow_corpus, num_terms=len(self.lda.dictionary))
+        doc_topic_dists = self.lda.doc_topic_matrix
+        if doc_topic_dists is None or doc_topic_dists.shape != (counts.shape[1], lda_model.num_topics):
+            doc_topic_dists = self.lda.infer_document_topics(lda_model, self.lda.bow_corpus)
+        doc_lengths = np.asarray(counts.sum(axis=0)).ravel()
+        term_frequency = np.asarray(counts.sum(axis=1)).ravel()
+        term_frequency[term_frequency == 0] = 0.01  # same smoothing as pyLDAvis.gensim_models
+        if sample_docs is not None and sample_docs < len(doc_lengths):
+            # the topic sizes are estimated on a random sample of the documents
+            rows = np.sort(np.random.default_rng(seed).choice(len(doc_lengths), sample_docs, replace=False))
+            doc_topic_dists, doc_lengths = doc_topic_dists[rows], doc_lengths[rows]
+        prepared = pyLDAvis.prepare(topic_term_dists, np.asarray(doc_topic_dists), doc_lengths, vocab, term_frequency,
+                                    n_jobs=n_jobs, sort_topics=False)
+        store.save(fingerprint, 'prepared', prepared)
+        return prepared
+
+    def pyviz_topics(self, file_name='figures/pyvis_topics.html', n_jobs=-1, sample_docs=None,
+                     cache_dir='out/pyldavis'):
+        _render_pyldavis({'prepared': self.prepare_topics(n_jobs, sample_docs, cache_dir=cache_dir)}, file_name, {})
         logging.info('pyvis html visualization is saved in: \n\t{}'.format(file_name))
 
-    @staticmethod
-    def generate_topic_words(topic_text, stopwords):
-        w_dict = {}
-        words = topic_text.replace("\n", ' ').replace(".", " ").replace(", ", " ").replace("\t", ' ').split(' ')
-        for w in words:
-            if len(w) > 2 and w.lower() not in stopwords and "'" not in w:
-                if w not in w_dict.keys():
-                    w_dict[w] = 0
-                w_dict[w] += 1
-        return w_dict
-
-    def generate_topics_wordcloud(self, file_name='figures/wordclouds.svg'):
-        self.df["processed_text"] = self.df['processed'].apply(" ".join)
-        topic_texts_df = self.df.groupby(['dominant_topic'])['processed_text'].apply(
-            ' '.join).reset_index()
-
-        cloud = WordCloud(background_color='white',
-                          width=2500,
-                          height=1800,
-                          max_words=60,
-                          prefer_horizontal=1.0)
-
-        only_two = False
-        if len(topic_texts_df) == 2:
-            fig, axes = plt.subplots(2, figsize=(10, 10),
-                                     sharex=True, sharey=True)
-            only_two = True
+    def document_term_matrix(self):
+        # terms x documents, the bag of words of the LDA model when it is aligned with the paragraphs
+        from gensim.matutils import corpus2csc
+        if len(self.lda.bow_corpus) == len(self.df):
+            bow_corpus = self.lda.bow_corpus
         else:
-            fig, axes = plt.subplots(math.ceil(len(topic_texts_df) / 2), 2, figsize=(10, 10),
-                                     sharex=True, sharey=True)
-
+            bow_corpus = (self.lda.dictionary.doc2bow(doc) for doc in self.df['processed'])
+        return corpus2csc(bow_corpus, num_terms=len(self.lda.dictionary), num_docs=len(self.df), dtype=np.int64)
+
+    def group_word_frequencies(self, keys):
+        # word counts of every group in a single sparse product with the document-group indicator matrix
+        from scipy import sparse
+        grouped = self.df.groupby(keys)
+        groups = grouped.ngroup().fillna(-1).to_numpy().astype(np.int64)
+        kept = np.flatnonzero(groups >= 0)
+        indicator = sparse.csr_matrix((np.ones(len(kept), dtype=np.int64), (kept, groups[kept])),
+                                      shape=(len(self.df), grouped.ngroups))
+        counts = (self.document_term_matrix() @ indicator).tocsc()
+        # word cloud filter (longer than 2 characters, no stopword, no apostrophe), applied once to the vocabulary
+        stopwords = self.lda.processor.stopwords
+        words = np.array([self.lda.dictionary[word_id] for word_id in range(counts.shape[0])], dtype=object)
+        allowed = np.array([len(w) > 2 and w.lower() not in stopwords and "'" not in w for w in words], dtype=bool)
+        frequencies = []
+        for group in range(grouped.ngroups):
+            start, end = counts.indptr[group], counts.indptr[group + 1]
+            word_ids, word_counts = counts.indices[start:end], counts.data[start:end]
+            mask = allowed[word_ids] & (word_counts > 0)
+            frequencies.append(dict(zip(words[word_ids[mask]], word_counts[mask].tolist())))
+        groups_df = grouped.size().index.to_frame(index=False)
+        groups_df['frequencies'] = frequencies
+        return groups_df
+
+    def topics_wordcloud_data(self):
+        topic_texts_df = self.group_word_frequencies(['dominant_topic'])
+        n_clouds = len(topic_texts_df)
+        if n_clouds == 2:
+            rows, columns = 2, 1
+        else:
+            rows, columns = math.ceil(n_clouds / 2), 2
+        clouds = []
         for idx, row in topic_texts_df.iterrows():
-            if only_two:
-                fig.add_subplot(axes[idx])
-            else:
-                fig.add_subplot(axes[math.floor(idx / 2), idx % 2])
-            topic_words = row['processed_text']
-            cloud.generate_from_frequencies(Vis.generate_topic_words(
-                topic_words, self.lda.processor.stopwords),
-                max_font_size=300)
-
-            plt.gca().imshow(cloud)
-            plt.gca().set_title('Topic ' + str(row['dominant_topic']), fontdict=dict(size=16))
-            plt.gca().axis('off')
-        if not only_two and len(topic_texts_df) % 2 == 1:  # remove extra empty plot in case of odd number of topics
-            fig.delaxes(axes[math.floor(len(topic_texts_df) / 2)][1])
-        plt.savefig(file_name, format='svg', dpi=1200)
+            position = (idx, 0) if n_clouds == 2 else (math.floor(idx / 2), idx % 2)
+            clouds.append(position + ('Topic ' + str(row['dominant_topic']), row['frequencies']))
+        empty = []
+        if n_clouds != 2 and n_clouds % 2 == 1:  # remove extra empty plot in case of odd number of topics
+            empty.append((math.floor(n_clouds / 2), 1))
+        return {'rows': rows, 'columns': columns, 'clouds': clouds, 'empty': empty}
+
+    def sentiments_wordcloud_data(self):
+        sentiment_texts_df = self.group_word_frequencies(['sentiment'])
+        clouds = [(idx, 0, 'Sentiment: ' + str(row['sentiment']), row['frequencies'])
+                  for idx, row in sentiment_texts_df.iterrows()]
+        return {'rows': 3, 'columns': 1, 'clouds': clouds}
+
+    def topic_sentiments_wordcloud_data(self):
+        st_texts_df = self.group_word_frequencies(['dominant_topic', 'sentiment'])
+        columns = {'POSITIVE': 0, 'NEUTRAL': 1, 'NEGATIVE': 2}
+        # one row per labelled topic, a topic that is never dominant does not leave a gap
+        rows = {topic: idx for idx, topic in enumerate(st_texts_df['dominant_topic'].unique())}
+        clouds = [(rows[row['dominant_topic']], columns.get(row['sentiment'], 0),
+                   'Topic {0}:{1}'.format(str(row['dominant_topic']), str(row['sentiment'])), row['frequencies'])
+                  for idx, row in st_texts_df.iterrows()]
+        return {'rows': len(rows), 'columns': 3, 'clouds': clouds}
+
+    def generate_topics_wordcloud(self, file_name='figures/wordclouds.svg'):
+        _render_wordclouds(self.topics_wordcloud_data(), file_name, RENDER_PRESETS['publication'])
         logging.info("wordclouds are generated and saved in:\t{}".format(file_name))
 
     def generate_sentiments_wordcloud(self, file_name='figures/wordclouds_sentiments.svg'):
-        self.df["processed_text"] = self.df['processed'].apply(" ".join)
-        sentiment_texts_df = self.df.groupby(['sentiment'])['processed_text'].apply(
-            ' '.join).reset_index()
-
-        cloud = WordCloud(background_color='white',
-                          width=2500,
-                          height=1800,
-                          max_words=60,
-                          prefer_horizontal=1.0)
-
-        fig, axes = plt.subplots(3, 1, figsize=(10, 10),
-                                 sharex=True, sharey=True)
-        for idx, row in sentiment_texts_df.iterrows():
-            fig.add_subplot(axes[idx])
-            sentiment_words = row['processed_text']
-            cloud.generate_from_frequencies(Vis.generate_topic_words(
-                sentiment_words, self.lda.processor.stopwords),
-                max_font_size=300)
-
-            plt.gca().imshow(cloud)
-            plt.gca().set_title('Sentiment: ' + str(row['sentiment']), fontdict=dict(size=16))
-            plt.gca().axis('off')
-        plt.savefig(file_name, format='svg', dpi=1200)
+        _render_wordclouds(self.sentiments_wordcloud_data(), file_name, RENDER_PRESETS['publication'])
         logging.info("wordclouds are generated and saved in:\t{}".format(file_name))
 
     def generate_topic_sentiments_wordcloud(self, file_name='figures/wordclouds_topic_sentiments.svg'):
-        self.df["processed_text"] = self.df['processed'].apply(" ".join)
-        st_texts_df = self.df.groupby(['dominant_topic', 'sentiment'])['processed_text'].apply(
-            ' '.join).reset_index()
-
-        cloud = WordCloud(background_color='white',
-                          width=2500,
-                          height=1800,
-                          max_words=60,
-                          prefer_horizontal=1.0)
-
-        fig, axes = plt.subplots(len(st_texts_df['dominant_topic'].unique()), 3, figsize=(10, 10),
-                                 sharex=True, sharey=True)
-        for idx, row in st_texts_df.iterrows():
-            col = 0
-            if row['sentiment'] == 'NEUTRAL':
-                col = 1
-            elif row['sentiment'] == 'NEGATIVE':
-                col = 2
-            fig.add_subplot(axes[int(row['dominant_topic']) - 1, col])
-            st_words = row['processed_text']
-            cloud.generate_from_frequencies(Vis.generate_topic_words(
-                st_words, self.lda.processor.stopwords),
-                max_font_size=300)
-
-            plt.gca().imshow(cloud)
-            plt.gca().set_title('Topic {0}:{1}'.format(str(row['dominant_topic']),
-                                                       str(row['sentiment'])), fontdict=dict(size=16))
-            plt.gca().axis('off')
-        plt.savefig(file_name, format='svg', dpi=1200)
+        _render_wordclouds(self.topic_sentiments_wordcloud_data(), file_name, RENDER_PRESETS['publication'])
         logging.info("wordclouds are generated and saved in:\t{}".format(file_name))
 
     def create_detailed_sentiment_info(self):
-        list_dict_info = []
-        for idx, row in self.df.iterrows():
-            if isinstance(row['sentiment_details'], dict):
-                sent_dict = row['sentiment_details']
-            else:
-                string_json = str(row['sentiment_details'])
-                string_json = string_json.replace("'", '"')
-                sentence_counter = math.ceil((len(string_json.split(":")) - 2) / 4) + 1
-                for i in range(sentence_counter, -1, -1):
-                    string_json = string_json.replace("{}:".format(i), '"{}":'.format(i))
-                try:
-                    sent_dict = json.loads(string_json)
-                except:
-                    print("error \n{0} \n{1}\n\n".format(row['sentiment_details'], string_json))
-            for key, sent_info in sent_dict.items():
-                tmp = {'book': row['book'],
-                       'chapter': row['chapter'],
-                       'paragraph_number': row['paragraph_number'],
-                       'dominant_topic': row['dominant_topic'],
-                       'perc_contribution': row['perc_contribution'],
-                       'sentence_number': key,
-                       'sentence_prec': sent_info['len'],
-                       'sentence_sentiment': sent_info['tag'],
-                       'sentence_sentiment_score': sent_info['score']
-                       }
-                list_dict_info.append(tmp)
-        sentence_level_df = pd.DataFrame(list_dict_info)
-        return sentence_level_df
+        # the sentence table of Sentiment is joined with the topics of its paragraphs, nothing is parsed
+        sentence_df = self.sentiment.sentence_df
+        if sentence_df is None:
+            sentence_df = Sentiment.create_sentence_df(self.df, self.df['sentiment_details'])
+        return Vis.join_sentence_topics(self.df, sentence_df)
+
+    @staticmethod
+    def join_sentence_topics(df, sentence_df):
+        topics_df = df[PARAGRAPH_KEYS + ['dominant_topic', 'perc_contribution']]
+        sentence_level_df = pd.merge(sentence_df, topics_df, how='left', on=PARAGRAPH_KEYS)
+        return sentence_level_df[PARAGRAPH_KEYS + ['dominant_topic', 'perc_contribution'] +
+                                 SENTENCE_COLUMNS[len(PARAGRAPH_KEYS):]]
+
+    def sentence_scores_data(self, columns):
+        return {'df': self.sent_sentiment[columns]}
+
+    def topic_columns_data(self):
+        df_tmp = self.sent_cube.rollup(['dominant_topic', 'sentence_sentiment'])['rows']. \
+            rename('sentence_number').reset_index()
+        # plotnine needs plain numbers on a continuous axis (the groups have no missing topic)
+        df_tmp['dominant_topic'] = df_tmp['dominant_topic'].astype(np.int64)
+        return {'df': df_tmp}
 
     def plot_sentiment_score_distributions(self,
                                            file_name='figures/sentiment_score_distribution.png',
                                            alpha=0.1):
-        fig = (ggplot(self.sent_sentiment,
-                      aes(x='sentence_sentiment_score', color='sentence_sentiment', fill='sentence_sentiment'))
-               + geom_density(alpha=alpha)
-               )
-        fig.save(file_name, dpi=300)
+        data = self.sentence_scores_data(['sentence_sentiment_score', 'sentence_sentiment'])
+        data['alpha'] = alpha
+        _render_density(data, file_name, {'dpi': 300})
         logging.info("sentiment distribution plot is generated and saved in:\t{}".format(file_name))
 
     def plot_sentiment_score_distributions_violin(self, file_name='figures/sentiment_score_distribution_violin.png'):
-
-        sns.boxplot(x='dominant_topic', y='sentence_sentiment_score', notch=True,
-                    data=self.sent_sentiment, showfliers=True)
-        plt.xticks(rotation=90)
-        plt.savefig(file_name, dpi=300)
+        _render_violin(self.sentence_scores_data(['dominant_topic', 'sentence_sentiment_score']), file_name,
+                       {'dpi': 300})
         logging.info("sentiment distribution - violin plot is generated and saved in:\t{}".format(file_name))
 
     def plot_sentiment_score_distributions_boxplot(self, file_name='figures/sentiment_score_distribution_boxplot.html'):
-        sns.boxplot(x='dominant_topic', y='sentence_sentiment_score', notch=True,
-                    data=self.sent_sentiment, showfliers=True)
-        fig = px.box(self.sent_sentiment, x="dominant_topic", y="sentence_sentiment_score", color="sentence_sentiment")
-        fig.update_traces(quartilemethod="exclusive")
+        fig = _boxplot_figure(self.sentence_scores_data(['dominant_topic', 'sentence_sentiment_score',
+                                                         'sentence_sentiment']))
         fig.write_html(file_name)
         fig.show()
         logging.info("sentiment distribution - box plot is generated and saved in:\t{}".format(file_name))
 
     def plot_sentiment_distributions_per_topic(self,
                                                file_name='figures/sentiment_distribution_per_topic.png'):
-        df_tmp = self.sent_sentiment. \
-            groupby(['dominant_topic', 'sentence_sentiment'], as_index=False). \
-            agg({'sentence_number': ['count']})
-        df_tmp.columns = df_tmp.columns.droplevel(1)
-        fig = (ggplot(df_tmp, aes('dominant_topic', 'sentence_number', fill='sentence_sentiment'))
-               + geom_col()
-               + scale_x_continuous()
-               )
-        fig.save(file_name, dpi=300)
+        _render_topic_columns(self.topic_columns_data(), file_name, {'dpi': 300})
         logging.info("sentiment distribution plot is generated and saved in:\t{}".format(file_name))
 
+    def figures(self, preset='draft'):
+        # every figure of render_all: file name -> (renderer, input data of the renderer)
+        extension = RENDER_PRESETS[preset]['extension']
+        density = self.sentence_scores_data(['sentence_sentiment_score', 'sentence_sentiment'])
+        density['alpha'] = 0.1
+        figures = {
+            'chapter_sentiments.html': (_render_treemap, self.chapter_sentiments_data()),
+            'chapter_topic.html': (_render_treemap, self.chapter_topic_data()),
+            'topic_sentiment.html': (_render_treemap, self.topic_sentiment_data()),
+            'wordclouds.' + extension: (_render_wordclouds, self.topics_wordcloud_data()),
+            'wordclouds_sentiments.' + extension: (_render_wordclouds, self.sentiments_wordcloud_data()),
+            'wordclouds_topic_sentiments.' + extension: (_render_wordclouds,
+                                                         self.topic_sentiments_wordcloud_data()),
+            'sentiment_score_distribution.' + extension: (_render_density, density),
+            'sentiment_score_distribution_violin.' + extension: (
+                _render_violin, self.sentence_scores_data(['dominant_topic', 'sentence_sentiment_score'])),
+            'sentiment_score_distribution_boxplot.html': (
+                _render_boxplot, self.sentence_scores_data(['dominant_topic', 'sentence_sentiment_score',
+                                                            'sentence_sentiment'])),
+            'sentiment_distribution_per_topic.' + extension: (_render_topic_columns, self.topic_columns_data()),
+        }
+        if self.lda.lda_model is not None:
+            figures['pyvis_topics.html'] = (_render_pyldavis, {'prepared': self.prepare_topics()})
+        return figures
+
+    def render_all(self, out_dir='figures', workers=None, preset='draft', force=False):
+        # figures whose input data and options are unchanged since the last run (manifest.json) are not rendered
+        options = RENDER_PRESETS[preset]
+        os.makedirs(out_dir, exist_ok=True)
+        manifest_file = os.path.join(out_dir, 'manifest.json')
+        manifest = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as fp:
+                manifest = json.load(fp)
+        stale = {}
+        for name, (renderer, data) in self.figures(preset).items():
+            # the html figures do not depend on the preset
+            figure_options = {} if name.endswith('.html') else options
+            fingerprint = _figure_fingerprint(renderer, data, figure_options)
+            if force or manifest.get(name) != fingerprint or not os.path.exists(os.path.join(out_dir, name)):
+                stale[name] = (renderer, data, figure_options, fingerprint)
+        logging.info("{0} figures to render in {1}, the others are unchanged".format(len(stale), out_dir))
+        if workers is None:
+            workers = min(len(stale), os.cpu_count())
+        try:
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_render_worker) as executor:
+                    futures = {name: executor.submit(renderer, data, os.path.join(out_dir, name), figure_options)
+                               for name, (renderer, data, figure_options, fingerprint) in stale.items()}
+                    for name, future in futures.items():
+                        future.result()
+                        manifest[name] = stale[name][3]
+            else:
+                for name, (renderer, data, figure_options, fingerprint) in stale.items():
+                    renderer(data, os.path.join(out_dir, name), figure_options)
+                    manifest[name] = fingerprint
+        finally:
+            with open(manifest_file, 'w') as fp:
+                json.dump(manifest, fp, indent=2, sort_keys=True)
+        logging.info("figures are rendered in:\t{}".format(out_dir))
+        return [os.path.join(out_dir, name) for name in stale]
+
+    # the reports keep the layout of df.groupby(..., as_index=False).agg(...), the medians come from the quantile
+    # sketches of the cubes: exact for groups of up to 3 rows, otherwise within 0.001 (the bin width of the scores)
     def generate_stat_report_sentiment_per_sentence(self):
-        df_tmp = self.sent_sentiment. \
-            groupby(['sentence_sentiment'], as_index=False). \
-            agg({'sentence_sentiment_score': ['count', 'median', 'mean']})
-        return df_tmp
+        return self.sent_cube.report(['sentence_sentiment'], 'sentence_sentiment_score', ['count', 'median', 'mean'])
 
     def generate_stat_report_sentiment_per_sentence_per_book(self):
-        df_tmp = self.sent_sentiment. \
-            groupby(['book', 'sentence_sentiment'], as_index=False). \
-            agg({'sentence_sentiment_score': ['count', 'median', 'mean']})
-        return df_tmp
+        return self.sent_cube.report(['book', 'sentence_sentiment'], 'sentence_sentiment_score',
+                                     ['count', 'median', 'mean'])
 
     def generate_stat_report_sentiment_per_sentence_per_chapter(self):
-        df_tmp = self.sent_sentiment. \
-            groupby(['book', 'chapter', 'sentence_sentiment'], as_index=False). \
-            agg({'sentence_sentiment_score': ['count', 'median', 'mean']})
-        return df_tmp
+        return self.sent_cube.report(['book', 'chapter', 'sentence_sentiment'], 'sentence_sentiment_score',
+                                     ['count', 'median', 'mean'])
 
     def generate_stat_report_sentiment_per_sentence_per_topic(self):
-        df_tmp = self.sent_sentiment. \
-            groupby(['dominant_topic', 'sentence_sentiment'], as_index=False). \
-            agg({'sentence_sentiment_score': ['count', 'median', 'mean']})
-        return df_tmp
+        return self.sent_cube.report(['dominant_topic', 'sentence_sentiment'], 'sentence_sentiment_score',
+                                     ['count', 'median', 'mean'])
 
     def generate_stat_report_sentiment_per_paragraph(self):
-        df_tmp = self.df. \
-            groupby(['sentiment'], as_index=False). \
-            agg({'paragraph_number': ['count']})
-        return df_tmp
+        return self.paragraph_cube.report(['sentiment'], 'paragraph_number', ['rows'], ['count'])
 
     def generate_stat_report_sentiment_per_paragraph_per_book(self):
-        df_tmp = self.df. \
-            groupby(['book', 'sentiment'], as_index=False). \
-            agg({'paragraph_number': ['count']})
-        return df_tmp
+        return self.paragraph_cube.report(['book', 'sentiment'], 'paragraph_number', ['rows'], ['count'])
 
     def generate_stat_report_sentiment_per_paragraph_per_chapter(self):
-        df_tmp = self.df. \
-            groupby(['book', 'chapter', 'sentiment'], as_index=False). \
-            agg({'paragraph_number': ['count']})
-        return df_tmp
+        return self.paragraph_cube.report(['book', 'chapter', 'sentiment'], 'paragraph_number', ['rows'], ['count'])
 
     def generate_stat_report_sentiment_per_paragraph_per_topic(self):
-        df_tmp = self.df. \
-            groupby(['dominant_topic', 'sentiment'], as_index=False). \
-            agg({'perc_contribution': ['count', 'median', 'mean', 'min', 'max']})
-        return df_tmp
+        return self.paragraph_cube.report(['dominant_topic', 'sentiment'], 'perc_contribution',
+                                          ['count', 'median', 'mean', 'min', 'max'])